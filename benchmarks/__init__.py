@@ -0,0 +1,4 @@
+"""Benchmarks of the scraping and checking hot paths.
+
+Run them with `python -m benchmarks`, see `python -m benchmarks --help`.
+"""
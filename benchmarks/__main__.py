@@ -0,0 +1,67 @@
+import argparse
+import sys
+from pathlib import Path
+
+from . import cases  # pylint: disable=unused-import
+from .runner import (
+    BASELINE_PATH,
+    BENCHMARKS,
+    find_regressions,
+    get_change,
+    load_baseline,
+    measure,
+    save_baseline,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Runs the benchmarks and compares them with the baseline.",
+    )
+    parser.add_argument(
+        "names", nargs="*", choices=[[], *BENCHMARKS], help="benchmarks to run"
+    )
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="store the results as baseline"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        help="relative slowdown or memory growth that fails, instead of the "
+        "threshold of each benchmark in the baseline (default: 0.25)",
+    )
+    parser.add_argument("--repeats", type=int, default=15)
+    parser.add_argument(
+        "--profile", type=Path, metavar="FOLDER", help="save a profile of each one"
+    )
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    results = []
+    for name in args.names or BENCHMARKS:
+        result = measure(name, repeats=args.repeats, profile_folder=args.profile)
+        results.append(result)
+
+        line = f"{name:<24} {result.ops_per_sec:>12,.1f} ops/sec"
+        line += f" {result.peak_memory / 1024:>10,.1f} KiB"
+        if name in baseline:
+            change = get_change(result, baseline[name])
+            line += f" {change:>+8.1%} time vs baseline"
+        print(line)
+
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    regressions = find_regressions(results, baseline, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Benchmarks of the hot paths, fed with the responses saved in fixtures."""
+
+import json
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+from dominos.cassette import Cassette
+from dominos.fakeserver import FakeServer
+from dominos.locations import build_shop_from_soup, get_shop_by_address
+from dominos.main import Dominos, update_codes
+from dominos.networking import settings
+from dominos.parsing import PromotionTracker, parse_elements
+from dominos.schemas import Address, Information, OrderType, ShowableWorkingCode
+
+from .runner import benchmark
+
+FIXTURES_PATH = Path(__file__).with_name("fixtures")
+
+# The city of the shops of the BuscarTiendas fixture.
+ADDRESS = Address(
+    province="a coruña", city="arteixo", street_name="calle mayor", street_number=1
+)
+
+
+def read_fixture(name: str) -> str:
+    return (FIXTURES_PATH / name).read_text("utf8")
+
+
+def build_response(text: str, content_type: str) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["content-type"] = f"{content_type}; charset=utf-8"
+    response.encoding = "utf-8"
+    response._content = text.encode("utf8")  # pylint: disable=protected-access
+    return response
+
+
+class FixtureDownloader:
+    """Answers AplicarCodPromo and promociones with the fixtures."""
+
+    def __init__(self, working: bool):
+        data = json.loads(read_fixture("aplicar-cod-promo.json"))
+        data = data["working" if working else "not_working"]
+        self.apply_response = build_response(json.dumps(data), "application/json")
+        self.promotions_response = build_response(
+            read_fixture("promociones.html"), "text/html"
+        )
+
+    def post(self, url, **kwargs):
+        return self.apply_response
+
+    def get(self, url, **kwargs):
+        return self.promotions_response
+
+
+def replayed(path: Path, workload):
+    """Records a workload run against the fake server.
+
+    Returns:
+        Callable[[], Any]: runs the workload again replaying the recording.
+    """
+
+    with FakeServer() as server, Cassette(path, mode="record"):
+        workload()
+    base_url = server.url
+    cassette = Cassette(path)
+
+    def replay():
+        previous_base_url = settings.base_url
+        settings.base_url = base_url
+        cassette.rewind()
+        try:
+            with cassette:
+                return workload()
+        finally:
+            settings.base_url = previous_base_url
+
+    return replay
+
+
+@benchmark("build_shop_from_soup")
+def bench_build_shop_from_soup():
+    html = read_fixture("buscar-tiendas.html")
+    shops_list = parse_elements(html, "ul", class_="listTiendas")[0]
+    shops = shops_list.find_all("li", attrs={"data-idtienda": True})
+    yield lambda: [build_shop_from_soup(x) for x in shops]
+
+
+def _check_code_setup(working: bool):
+    dominos = Dominos()
+    dominos.downloader = FixtureDownloader(working)
+    dominos.order_type = OrderType.delivery
+    dominos._token = "token"  # pylint: disable=protected-access
+
+    def check_code():
+        dominos.promotions = PromotionTracker()
+        return dominos.check_code("10FAM")
+
+    return check_code
+
+
+@benchmark("check_code_working")
+def bench_check_code_working():
+    yield _check_code_setup(working=True)
+
+
+@benchmark("check_code_not_working")
+def bench_check_code_not_working():
+    yield _check_code_setup(working=False)
+
+
+@benchmark("get_shop_by_address")
+def bench_get_shop_by_address():
+    with tempfile.TemporaryDirectory() as folder:
+        yield replayed(
+            Path(folder) / "shop.json.gz", lambda: get_shop_by_address(ADDRESS)
+        )
+
+
+@benchmark("information_json")
+def bench_information_json():
+    html = read_fixture("buscar-tiendas.html")
+    shop_soup = parse_elements(html, "li", class_="tienda")[0]
+    shop = build_shop_from_soup(shop_soup)
+    codes = [
+        ShowableWorkingCode(
+            description=f"Promoción {n}", expires=datetime(2026, 12, 31), code=str(n)
+        )
+        for n in range(20)
+    ]
+    info = Information(
+        shop=shop,
+        updated=datetime(2026, 1, 1),
+        order_types={x.value: codes for x in OrderType},
+    )
+    yield lambda: info.json(ensure_ascii=False, indent=4)
+
+
+@benchmark("update_codes")
+def bench_update_codes():
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+
+        def workload():
+            # Failed shops are only logged, so they would go unnoticed.
+            if not update_codes([ADDRESS], base_folder=folder):
+                raise RuntimeError("update_codes failed")
+
+        yield replayed(folder / "update-codes.json.gz", workload)
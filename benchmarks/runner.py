@@ -0,0 +1,179 @@
+"""Registry, measurement and baseline comparison of the benchmarks."""
+
+import json
+import timeit
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, ContextManager, Dict, Iterator, List, NamedTuple, Optional
+
+from dominos import profiling
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+
+DEFAULT_THRESHOLD = 0.25
+
+Setup = Callable[[], ContextManager[Callable[[], object]]]
+
+BENCHMARKS: Dict[str, Setup] = {}
+
+
+def benchmark(name: str):
+    """Registers a benchmark.
+
+    The decorated function is a generator that prepares the benchmark, yields
+    the operation measured and cleans up after it.
+    """
+
+    def decorator(func: Callable[[], Iterator[Callable[[], object]]]):
+        BENCHMARKS[name] = contextmanager(func)
+        return func
+
+    return decorator
+
+
+class Result(NamedTuple):
+    name: str
+    ops_per_sec: float
+    peak_memory: int
+    # Time of an operation in runs of the calibration loop.
+    relative_time: float
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "ops_per_sec": self.ops_per_sec,
+            "peak_memory": self.peak_memory,
+            "relative_time": self.relative_time,
+        }
+
+
+def calibration_loop():
+    """Fixed pure-Python work, timed to factor out the speed of the machine."""
+
+    data = {}
+    for n in range(1000):
+        data[str(n)] = [n, n * 2]
+    return sorted(data.items(), key=lambda x: x[1][1])
+
+
+def measure(name: str, repeats=15, profile_folder: Optional[Path] = None) -> Result:
+    """Runs a benchmark, keeping its best time of several repeats.
+
+    Each repeat also times the calibration loop, and the best time of the
+    benchmark is divided by the best time of the loop. That relative time
+    varies much less than the absolute one between runs and machines, since
+    both are slowed down alike by the CPU frequency and the load.
+
+    Args:
+        name (str): name of the benchmark.
+        repeats (int, optional): number of timed repeats. Defaults to 15.
+        profile_folder (Path, optional): if given, one more operation is
+            profiled and saved in the folder, see `dominos.profiling`.
+            Defaults to None.
+
+    Returns:
+        Result: operations per second, peak memory allocated by one
+            operation, in bytes, and time relative to the calibration loop.
+    """
+
+    calibration = timeit.Timer(calibration_loop)
+    calibration_number, _ = calibration.autorange()
+
+    with BENCHMARKS[name]() as operation:
+        operation()  # warm up caches
+
+        timer = timeit.Timer(operation)
+        number, _ = timer.autorange()
+        best = best_calibration = float("inf")
+        for _ in range(repeats):
+            best = min(best, timer.timeit(number) / number)
+            best_calibration = min(
+                best_calibration,
+                calibration.timeit(calibration_number) / calibration_number,
+            )
+
+        tracemalloc.start()
+        try:
+            operation()
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        if profile_folder:
+            profile_folder.mkdir(parents=True, exist_ok=True)
+            with profiling.profile(profile_folder / name):
+                operation()
+
+    return Result(name, 1 / best, peak_memory, best / best_calibration)
+
+
+def load_baseline(path: Path = BASELINE_PATH) -> Dict[str, Dict[str, float]]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text("utf8"))
+
+
+def save_baseline(results: List[Result], path: Path = BASELINE_PATH):
+    baseline = load_baseline(path)
+    for result in results:
+        # Tolerances set by hand are kept.
+        baseline.setdefault(result.name, {}).update(result.to_dict())
+    path.write_text(json.dumps(baseline, indent=4, sort_keys=True) + "\n", "utf8")
+
+
+def get_change(result: Result, expected: Dict[str, float]) -> float:
+    """Returns the relative slowdown of a result, negative if it's faster.
+
+    Relative times are compared if the baseline has them, and operations per
+    second otherwise.
+    """
+
+    if "relative_time" in expected:
+        return result.relative_time / expected["relative_time"] - 1
+    return expected["ops_per_sec"] / result.ops_per_sec - 1
+
+
+def find_regressions(
+    results: List[Result],
+    baseline: Dict[str, Dict[str, float]],
+    threshold: Optional[float] = None,
+) -> List[str]:
+    """Compares the results with the baseline.
+
+    Args:
+        results (List[Result]): results of the benchmarks.
+        baseline (Dict[str, Dict[str, float]]): stored results.
+        threshold (float, optional): relative slowdown or memory growth
+            tolerated. If none, the `threshold` of each benchmark in the
+            baseline is used, or `DEFAULT_THRESHOLD`. Defaults to None.
+
+    Returns:
+        List[str]: description of each regression.
+    """
+
+    regressions = []
+    for result in results:
+        if result.name not in baseline:
+            continue
+
+        expected = baseline[result.name]
+        tolerance = threshold
+        if tolerance is None:
+            tolerance = expected.get("threshold", DEFAULT_THRESHOLD)
+
+        change = get_change(result, expected)
+        if change > tolerance:
+            regressions.append(
+                f"{result.name}: {change:+.1%} slower, "
+                f"{result.ops_per_sec:,.1f} ops/sec, "
+                f"baseline {expected['ops_per_sec']:,.1f}"
+            )
+
+        max_memory = expected["peak_memory"] * (1 + tolerance)
+        if result.peak_memory > max_memory:
+            regressions.append(
+                f"{result.name}: {result.peak_memory:,} bytes, "
+                f"baseline {expected['peak_memory']:,}"
+            )
+
+    return regressions
@@ -0,0 +1,376 @@
+"""Asyncio engine to check many codes concurrently in the same shop."""
+
+import asyncio
+import logging
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+
+import aiohttp
+
+from . import metrics
+from .cache import ResultCache
+from .codes import get_codes
+from .exceptions import DownloaderError
+from .networking import (
+    NEW_HEADERS,
+    connection_stats,
+    get_breaker,
+    get_retry_policy,
+    get_throttle,
+    get_endpoint_label,
+    get_url,
+    record_response_metrics,
+    settings,
+)
+from .parsing import PromotionTracker, parse_token
+from .scheduler import Budget, CodeScheduler
+from .schemas import AppliedPromotion, OrderType, Shop, WorkingCode
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+def _get_trace_config() -> aiohttp.TraceConfig:
+    """Counts the connections in `dominos.networking.connection_stats`."""
+
+    async def on_request_start(session, context, params):
+        connection_stats.record_request()
+
+    async def on_connection_create_end(session, context, params):
+        connection_stats.record_new()
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    return trace_config
+
+
+class AsyncDownloader:
+    """Asyncio downloader with retries control.
+
+    Each instance owns its own `aiohttp.ClientSession`, and therefore its own
+    cookie jar, so every instance represents an independent order session.
+
+    Args:
+        retries (int, optional): number of retries for each request. If none,
+            it's set to settings.retries. Defaults to None.
+        retry_policy (RetryPolicy, optional): backoff and retried status
+            codes. If none, the shared `dominos.networking.get_retry_policy()`
+            is used. Defaults to None.
+    """
+
+    def __init__(self, retries=None, retry_policy=None):
+        self.logger = logging.getLogger(__name__)
+        self.retries = retries or settings.retries
+        self.retry_policy = retry_policy
+        self.timeout = aiohttp.ClientTimeout(total=settings.timeout)
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(
+            limit=settings.pool_connections * settings.pool_maxsize,
+            limit_per_host=settings.pool_maxsize,
+            force_close=not settings.keep_alive,
+        )
+        self.session = aiohttp.ClientSession(
+            headers=NEW_HEADERS,
+            timeout=self.timeout,
+            connector=connector,
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+            trace_configs=[_get_trace_config()],
+        )
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(
+        self, method, url, retries=None, **kwargs
+    ) -> aiohttp.ClientResponse:
+        """Makes an HTTP request. The body is read before returning.
+
+        Args:
+            method (str): HTTP method of the request.
+            url (str): url of the request.
+            retries (int): override `AsyncDownloader.retries` for this request.
+            **kwargs: keyword arguments passed to aiohttp.ClientSession.request.
+
+        Raises:
+            CircuitOpenError: if the circuit breaker of the endpoint is open.
+            DownloaderError: if all retries failed.
+
+        Returns:
+            aiohttp.ClientResponse: HTTP response, with its body already read.
+                If its status code is retryable and all retries failed, the
+                last response is returned.
+        """
+
+        self.logger.debug("%s %r", method, url)
+        retries = retries or self.retries
+        policy = self.retry_policy or get_retry_policy()
+        breaker = get_breaker(url)
+        endpoint = get_endpoint_label(url) if metrics.enabled() else None
+        response = None
+
+        for attempt in range(retries):
+            probe = breaker.before_request() if breaker else False
+            policy.record_request(retry=attempt > 0)
+            retry_after = None
+            try:
+                async with get_throttle().limit_async(url):
+                    with metrics.timed(
+                        "dominos_request_seconds", endpoint=endpoint, method=method
+                    ):
+                        async with self.session.request(
+                            method, url, **kwargs
+                        ) as response:
+                            body = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                reason = type(exc).__name__
+                response = None
+                metrics.increment(
+                    "dominos_request_errors_total", endpoint=endpoint, error=reason
+                )
+            except BaseException:
+                # Cancelled or failed for other reasons than the server.
+                if probe:
+                    breaker.abort_probe()
+                raise
+            else:
+                if endpoint:
+                    record_response_metrics(endpoint, response.status, len(body))
+                if not policy.is_retryable(response.status):
+                    if breaker:
+                        breaker.record_success()
+                    return response
+                reason = f"HTTP {response.status}"
+                retry_after = response.headers.get("Retry-After")
+
+            if breaker:
+                breaker.record_failure()
+
+            remaining = retries - attempt - 1
+            self.logger.warning(
+                "Catched %s in %s, retries=%s", reason, method, remaining
+            )
+            if not remaining:
+                break
+
+            delay = policy.next_retry(attempt, reason, retry_after)
+            if delay is None:
+                self.logger.warning("Retry budget exhausted in %s %r", method, url)
+                break
+            metrics.increment("dominos_retries_total", endpoint=endpoint, reason=reason)
+            metrics.observe("dominos_retry_delay_seconds", delay, endpoint=endpoint)
+            await asyncio.sleep(delay)
+
+        if response is not None:
+            return response
+
+        self.logger.critical("Download error in %s %r", method, url)
+        raise DownloaderError("max retries failed.")
+
+    async def get(self, url, **kwargs) -> aiohttp.ClientResponse:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs) -> aiohttp.ClientResponse:
+        return await self.request("POST", url, **kwargs)
+
+
+class OrderSession:
+    """One server-side order, with its own cookies and anti-forgery token."""
+
+    def __init__(self, shop: Shop, order_type: OrderType):
+        self.downloader = AsyncDownloader()
+        self.shop = shop
+        self.order_type = order_type
+        self.promotions = PromotionTracker()
+        self.token: Optional[str] = None
+
+    async def __aenter__(self):
+        await self.downloader.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.downloader.close()
+
+    async def get_token(self) -> str:
+        url = get_url("promociones")
+        response = await self.downloader.get(url)
+        return parse_token(await response.text())
+
+    async def start_order(self):
+        self.token = await self.get_token()
+
+        payload = {
+            "idTienda": self.shop.id,
+            "tipoPedido": self.order_type.value.title(),
+        }
+
+        url = get_url("Pedido/IniciarPedidoSession")
+        response = await self.downloader.post(url, data=payload)
+        response.raise_for_status()
+        assert (await response.json(content_type=None))["result"] is True
+
+    async def check_code(self, code) -> List[AppliedPromotion]:
+        """Applies a code and returns the promotions it added to this order."""
+
+        return (await self.apply_code(code))[1]
+
+    async def apply_code(self, code) -> Tuple[bool, List[AppliedPromotion]]:
+        """Applies a code to the order.
+
+        Returns:
+            Tuple[bool, List[AppliedPromotion]]: whether the server accepted
+                the code, and the promotions it added to this order.
+        """
+
+        url = get_url("Promocion/AplicarCodPromo")
+        payload = {
+            "CodPromo": code,
+            "url": False,
+            "__RequestVerificationToken": self.token,
+        }
+
+        response = await self.downloader.post(url, data=payload)
+        response.raise_for_status()
+
+        data = await response.json(content_type=None)
+        if not data["result"]:
+            return False, []
+
+        new_promotions = self.promotions.update_from_response(data, self.order_type)
+        if new_promotions is None:
+            url = get_url("promociones")
+            response = await self.downloader.get(url)
+            html = await response.text()
+            new_promotions = self.promotions.update(html, self.order_type)
+
+        return True, new_promotions
+
+
+class AsyncDominos:
+    """Checks codes in a shop using several order sessions in parallel.
+
+    Args:
+        shop (Shop): shop to check the codes in.
+        order_type (OrderType): order type to check the codes with.
+        sessions (int, optional): number of independent order sessions used
+            to check codes concurrently. Defaults to 4.
+    """
+
+    def __init__(self, shop: Shop, order_type: OrderType, sessions=4):
+        self.shop = shop
+        self.order_type = order_type
+        self.sessions = sessions
+        self.promotions = PromotionTracker()
+
+    async def check_all_codes(
+        self,
+        codes: Optional[Iterable[str]] = None,
+        cache: Optional[ResultCache] = None,
+        scheduler: Optional[CodeScheduler] = None,
+        budget: Optional[Budget] = None,
+    ) -> AsyncIterator[WorkingCode]:
+        """Yields the working codes as soon as any session finds them.
+
+        Args:
+            codes (Iterable[str], optional): codes to check. If none, all the
+                known codes are checked. Defaults to None.
+            cache (ResultCache, optional): cache used to skip the codes that
+                failed recently, only used when all the known codes are
+                checked. Defaults to None.
+            scheduler (CodeScheduler, optional): scheduler used to check the
+                most promising codes first. Defaults to None.
+            budget (Budget, optional): limit of codes checked or time spent.
+                Defaults to None.
+        """
+
+        full_check = False
+        if codes is None:
+            codes = get_codes()
+            full_check = True
+            if cache:
+                full_check = cache.needs_full_check(self.shop.id, self.order_type)
+                if not full_check:
+                    codes = cache.filter_codes(codes, self.shop.id, self.order_type)
+        else:
+            cache = None
+
+        if cache:
+            cache.record_shop(self.shop)
+        if scheduler:
+            codes = scheduler.order(codes, self.shop, self.order_type)
+        codes = list(codes)
+        if budget and budget.max_checks is not None:
+            full_check = full_check and len(codes) <= budget.max_checks
+            codes = codes[: budget.max_checks]
+
+        pending_codes = asyncio.Queue()
+        for code in codes:
+            pending_codes.put_nowait(code)
+
+        loop = asyncio.get_running_loop()
+        deadline = None
+        if budget and budget.max_seconds is not None:
+            deadline = loop.time() + budget.max_seconds
+
+        results = asyncio.Queue()
+        n_workers = max(1, min(self.sessions, pending_codes.qsize()))
+        workers = [
+            asyncio.ensure_future(self._worker(pending_codes, results, cache, deadline))
+            for _ in range(n_workers)
+        ]
+
+        try:
+            while n_workers:
+                result = await results.get()
+                if result is _DONE:
+                    n_workers -= 1
+                elif isinstance(result, Exception):
+                    raise result
+                else:
+                    yield result
+
+            if cache and full_check and pending_codes.empty():
+                cache.record_sweep(self.shop.id, self.order_type)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _worker(
+        self,
+        pending_codes: asyncio.Queue,
+        results: asyncio.Queue,
+        cache: Optional[ResultCache],
+        deadline: Optional[float],
+    ):
+        loop = asyncio.get_running_loop()
+        try:
+            async with OrderSession(self.shop, self.order_type) as session:
+                await session.start_order()
+                while not pending_codes.empty():
+                    if deadline is not None and loop.time() >= deadline:
+                        break
+                    code = pending_codes.get_nowait()
+                    accepted, new_promotions = await session.apply_code(code)
+                    if cache:
+                        # A code giving a promotion already found still works.
+                        cache.record(code, self.shop.id, self.order_type, accepted)
+                    for promotion in new_promotions:
+                        # Several sessions can apply the same promotion, only
+                        # the first code found is reported, as in Dominos.
+                        if not self.promotions.add(promotion):
+                            continue
+                        await results.put(WorkingCode(code=code, **promotion.dict()))
+                        break
+        except Exception as exc:  # pylint: disable=broad-except
+            await results.put(exc)
+        finally:
+            await results.put(_DONE)
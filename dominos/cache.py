@@ -0,0 +1,463 @@
+"""Persistent stores in SQLite: code check results, shops and progress journal."""
+
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from pydantic import parse_raw_as
+
+from .locations import get_shop_by_address, normalize_name
+from .schemas import Address, Information, OrderType, Shop, WorkingCode
+
+DAY = 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStore:
+    """Thread-safe SQLite database shared by several threads.
+
+    Args:
+        path (Union[str, Path]): path of the SQLite database.
+    """
+
+    filename = "store.sqlite3"
+    schema: Tuple[str, ...] = ()
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            str(self.path), check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        for statement in self.schema:
+            self._connection.execute(statement)
+
+    @classmethod
+    def in_folder(cls, folder: Union[str, Path], **kwargs):
+        """Opens the database stored in a folder with the default file name."""
+
+        return cls(Path(folder) / cls.filename, **kwargs)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def execute(self, query: str, params=()) -> List[tuple]:
+        with self._lock:
+            return self._connection.execute(query, params).fetchall()
+
+
+class ResultCache(SQLiteStore):
+    """Remembers the last outcome of each code in each shop and order type.
+
+    It also keeps statistics of every code (checks, hits and last hit) and the
+    location of the shops, used by `dominos.scheduler.CodeScheduler`.
+
+    Codes that failed less than `ttl` seconds ago are skipped, unless the
+    last full check of the shop and order type is older than
+    `revalidate_interval` seconds, in which case every code is checked again.
+
+    Args:
+        path (Union[str, Path]): path of the SQLite database.
+        ttl (float, optional): seconds a failed code is skipped.
+            Defaults to 1 day.
+        revalidate_interval (float, optional): seconds between full checks of
+            a shop and order type. Defaults to 7 days.
+    """
+
+    filename = "results.sqlite3"
+    schema = (
+        "CREATE TABLE IF NOT EXISTS results ("
+        "code TEXT, shop_id INTEGER, order_type TEXT, working INTEGER, "
+        "checked_at REAL, PRIMARY KEY (code, shop_id, order_type))",
+        "CREATE TABLE IF NOT EXISTS sweeps ("
+        "shop_id INTEGER, order_type TEXT, checked_at REAL, "
+        "PRIMARY KEY (shop_id, order_type))",
+        "CREATE TABLE IF NOT EXISTS stats ("
+        "code TEXT, shop_id INTEGER, order_type TEXT, checks INTEGER, "
+        "hits INTEGER, last_hit REAL, PRIMARY KEY (code, shop_id, order_type))",
+        "CREATE TABLE IF NOT EXISTS shops ("
+        "shop_id INTEGER PRIMARY KEY, lat REAL, long REAL)",
+    )
+
+    def __init__(
+        self, path: Union[str, Path], ttl: float = DAY, revalidate_interval=7 * DAY
+    ):
+        super().__init__(path)
+        self.ttl = ttl
+        self.revalidate_interval = revalidate_interval
+
+    def record(self, code: str, shop_id: int, order_type: OrderType, working: bool):
+        """Saves the outcome of a code check."""
+
+        now = time.time()
+        last_hit = now if working else None
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (code, shop_id, order_type.value, int(working), now),
+            )
+            self._connection.execute(
+                "INSERT INTO stats VALUES (?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT (code, shop_id, order_type) DO UPDATE SET "
+                "checks = checks + 1, hits = hits + excluded.hits, "
+                "last_hit = COALESCE(excluded.last_hit, last_hit)",
+                (code, shop_id, order_type.value, int(working), last_hit),
+            )
+
+    def record_shop(self, shop: Shop):
+        """Saves the location of a shop."""
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO shops VALUES (?, ?, ?)",
+                (shop.id, shop.coords.lat, shop.coords.long),
+            )
+
+    def get_shops(self) -> Dict[int, Tuple[float, float]]:
+        """Returns the location (lat, long) of every known shop by its id."""
+
+        with self._lock:
+            rows = self._connection.execute("SELECT * FROM shops").fetchall()
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def get_stats(
+        self, order_type: OrderType, shop_ids: Optional[Iterable[int]] = None
+    ) -> Dict[str, Tuple[int, int, Optional[float]]]:
+        """Returns the statistics of every code, added up over several shops.
+
+        Args:
+            order_type (OrderType): order type.
+            shop_ids (Iterable[int], optional): shops to add up. If none, all
+                the shops are used. Defaults to None.
+
+        Returns:
+            Dict[str, Tuple[int, int, Optional[float]]]: checks, hits and last
+                hit timestamp of each code.
+        """
+
+        query = (
+            "SELECT code, SUM(checks), SUM(hits), MAX(last_hit) FROM stats "
+            "WHERE order_type = ?"
+        )
+        params = [order_type.value]
+        if shop_ids is not None:
+            shop_ids = list(shop_ids)
+            query += f" AND shop_id IN ({', '.join('?' * len(shop_ids))})"
+            params.extend(shop_ids)
+        query += " GROUP BY code"
+
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+        return {row[0]: (row[1], row[2], row[3]) for row in rows}
+
+    def record_sweep(self, shop_id: int, order_type: OrderType):
+        """Saves that all the codes were checked in a shop and order type."""
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO sweeps VALUES (?, ?, ?)",
+                (shop_id, order_type.value, time.time()),
+            )
+
+    def needs_full_check(self, shop_id: int, order_type: OrderType) -> bool:
+        """Checks if every code must be checked again in a shop and order type."""
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT checked_at FROM sweeps WHERE shop_id = ? AND order_type = ?",
+                (shop_id, order_type.value),
+            ).fetchone()
+
+        return row is None or time.time() - row[0] > self.revalidate_interval
+
+    def filter_codes(
+        self, codes: Iterable[str], shop_id: int, order_type: OrderType
+    ) -> List[str]:
+        """Removes the codes that failed recently in a shop and order type.
+
+        Args:
+            codes (Iterable[str]): codes to check.
+            shop_id (int): id of the shop.
+            order_type (OrderType): order type.
+
+        Returns:
+            List[str]: codes that should be checked, in the same order.
+        """
+
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT code FROM results WHERE shop_id = ? AND order_type = ? "
+                "AND working = 0 AND checked_at > ?",
+                (shop_id, order_type.value, time.time() - self.ttl),
+            ).fetchall()
+
+        skipped = {row[0] for row in rows}
+        return [code for code in codes if code not in skipped]
+
+    def last_result(
+        self, code: str, shop_id: int, order_type: OrderType
+    ) -> Optional[bool]:
+        """Returns the last outcome of a code, or None if it was never checked."""
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT working FROM results "
+                "WHERE code = ? AND shop_id = ? AND order_type = ?",
+                (code, shop_id, order_type.value),
+            ).fetchone()
+
+        return None if row is None else bool(row[0])
+
+
+class ShopCache(SQLiteStore):
+    """Remembers the shop closest to each address.
+
+    Args:
+        path (Union[str, Path]): path of the SQLite database.
+        ttl (float, optional): seconds a shop is considered fresh.
+            Defaults to 30 days.
+        stale_while_revalidate (bool, optional): if True, expired shops are
+            returned right away and refreshed in a background thread.
+            Defaults to False.
+    """
+
+    filename = "shops.sqlite3"
+    schema = (
+        "CREATE TABLE IF NOT EXISTS shops ("
+        "address TEXT PRIMARY KEY, shop TEXT, updated_at REAL)",
+    )
+
+    def __init__(
+        self, path: Union[str, Path], ttl=30 * DAY, stale_while_revalidate=False
+    ):
+        super().__init__(path)
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self._refreshing = set()
+
+    @staticmethod
+    def get_key(address: Address) -> str:
+        parts = (address.province, address.city, address.street_name)
+        return "|".join(
+            [normalize_name(x) for x in parts] + [str(address.street_number)]
+        )
+
+    def get(self, address: Address) -> Optional[Tuple[Shop, float]]:
+        """Returns the cached shop and when it was saved, or None."""
+
+        rows = self.execute(
+            "SELECT shop, updated_at FROM shops WHERE address = ?",
+            (self.get_key(address),),
+        )
+        if not rows:
+            return None
+        return Shop.parse_raw(rows[0][0]), rows[0][1]
+
+    def set(self, address: Address, shop: Shop):
+        self.execute(
+            "INSERT OR REPLACE INTO shops VALUES (?, ?, ?)",
+            (self.get_key(address), shop.json(), time.time()),
+        )
+
+    def invalidate(self, address: Optional[Address] = None):
+        """Removes the shop of an address, or every shop if address is None."""
+
+        if address is None:
+            self.execute("DELETE FROM shops")
+        else:
+            self.execute(
+                "DELETE FROM shops WHERE address = ?", (self.get_key(address),)
+            )
+
+    def get_shop(self, address: Address, strict=True) -> Shop:
+        """Returns the shop closest to an address, looking it up if needed.
+
+        Args:
+            address (Address): address.
+            strict (bool, optional): passed to `get_shop_by_address`.
+                Defaults to True.
+
+        Returns:
+            Shop: closest shop.
+        """
+
+        cached = self.get(address)
+        if cached:
+            shop, updated_at = cached
+            if time.time() - updated_at <= self.ttl:
+                return shop
+            if self.stale_while_revalidate:
+                self._refresh_in_background(address, strict)
+                return shop
+
+        return self._refresh(address, strict)
+
+    def _refresh(self, address: Address, strict: bool) -> Shop:
+        shop = get_shop_by_address(address, strict=strict)
+        self.set(address, shop)
+        return shop
+
+    def _refresh_in_background(self, address: Address, strict: bool):
+        key = self.get_key(address)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._refresh(address, strict)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Error refreshing shop of %s", address)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def get_shops(self) -> List[Shop]:
+        """Returns every cached shop, without duplicates."""
+
+        rows = self.execute("SELECT DISTINCT shop FROM shops")
+        shops = {}
+        for row in rows:
+            shop = Shop.parse_raw(row[0])
+            shops[shop.id] = shop
+        return list(shops.values())
+
+
+class Journal(SQLiteStore):
+    """Records the progress of `update_codes` so an interrupted run resumes.
+
+    Finished shops, finished order types of a shop and every code checked
+    are saved as soon as they're done. Entries older than `ttl` seconds are
+    ignored, so an old journal doesn't stop the shops from being updated.
+
+    Args:
+        path (Union[str, Path]): path of the SQLite database.
+        ttl (float, optional): seconds an entry is valid. Defaults to 1 day.
+    """
+
+    filename = "journal.sqlite3"
+    schema = (
+        "CREATE TABLE IF NOT EXISTS shops ("
+        "address TEXT PRIMARY KEY, information TEXT, recorded_at REAL)",
+        "CREATE TABLE IF NOT EXISTS order_types ("
+        "shop_id INTEGER, order_type TEXT, codes TEXT, recorded_at REAL, "
+        "PRIMARY KEY (shop_id, order_type))",
+        "CREATE TABLE IF NOT EXISTS codes ("
+        "shop_id INTEGER, order_type TEXT, code TEXT, working_code TEXT, "
+        "recorded_at REAL, PRIMARY KEY (shop_id, order_type, code))",
+    )
+
+    def __init__(self, path: Union[str, Path], ttl: float = DAY):
+        super().__init__(path)
+        self.ttl = ttl
+
+    def record_shop(self, address: Address, info: Information):
+        """Saves that the shop of an address was updated."""
+
+        self.execute(
+            "INSERT OR REPLACE INTO shops VALUES (?, ?, ?)",
+            (ShopCache.get_key(address), info.json(), time.time()),
+        )
+
+    def get_shop(self, address: Address) -> Optional[Information]:
+        """Returns the information of a finished shop, or None."""
+
+        rows = self.execute(
+            "SELECT information FROM shops WHERE address = ? AND recorded_at > ?",
+            (ShopCache.get_key(address), time.time() - self.ttl),
+        )
+        return Information.parse_raw(rows[0][0]) if rows else None
+
+    def record_order_type(
+        self, shop_id: int, order_type: OrderType, codes: List[WorkingCode]
+    ):
+        """Saves the working codes of a finished shop and order type."""
+
+        data = "[" + ",".join(x.json() for x in codes) + "]"
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO order_types VALUES (?, ?, ?, ?)",
+                (shop_id, order_type.value, data, time.time()),
+            )
+            # The codes of a finished order type aren't needed any more.
+            self._connection.execute(
+                "DELETE FROM codes WHERE shop_id = ? AND order_type = ?",
+                (shop_id, order_type.value),
+            )
+
+    def get_order_type(
+        self, shop_id: int, order_type: OrderType
+    ) -> Optional[List[WorkingCode]]:
+        """Returns the working codes of a finished order type, or None."""
+
+        rows = self.execute(
+            "SELECT codes FROM order_types "
+            "WHERE shop_id = ? AND order_type = ? AND recorded_at > ?",
+            (shop_id, order_type.value, time.time() - self.ttl),
+        )
+        return parse_raw_as(List[WorkingCode], rows[0][0]) if rows else None
+
+    def record_code(
+        self,
+        code: str,
+        shop_id: int,
+        order_type: OrderType,
+        working_code: Optional[WorkingCode],
+    ):
+        """Saves the outcome of a code check."""
+
+        data = working_code.json() if working_code else None
+        self.execute(
+            "INSERT OR REPLACE INTO codes VALUES (?, ?, ?, ?, ?)",
+            (shop_id, order_type.value, code, data, time.time()),
+        )
+
+    def get_codes(
+        self, shop_id: int, order_type: OrderType
+    ) -> Dict[str, Optional[WorkingCode]]:
+        """Returns the codes checked in a shop and order type.
+
+        Args:
+            shop_id (int): id of the shop.
+            order_type (OrderType): order type.
+
+        Returns:
+            Dict[str, Optional[WorkingCode]]: the working code of each code
+                checked, or None if it didn't work.
+        """
+
+        rows = self.execute(
+            "SELECT code, working_code FROM codes "
+            "WHERE shop_id = ? AND order_type = ? AND recorded_at > ?",
+            (shop_id, order_type.value, time.time() - self.ttl),
+        )
+        return {x: WorkingCode.parse_raw(y) if y else None for x, y in rows}
+
+    def forget_shop(self, address: Address, shop_id: int):
+        """Forgets the progress of a shop, so its next update starts over."""
+
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM shops WHERE address = ?", (ShopCache.get_key(address),)
+            )
+            for table in ("order_types", "codes"):
+                self._connection.execute(
+                    f"DELETE FROM {table} WHERE shop_id = ?", (shop_id,)
+                )
+
+    def clear(self):
+        """Forgets the progress, once every shop was updated."""
+
+        with self._lock:
+            for table in ("shops", "order_types", "codes"):
+                self._connection.execute(f"DELETE FROM {table}")
@@ -0,0 +1,229 @@
+"""Record and replay of HTTP interactions, to run the code without network."""
+
+import base64
+import gzip
+import io
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.client import HTTPMessage
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse
+
+from .exceptions import CassetteMissError
+from .networking import settings
+
+Key = Tuple[str, str, str, str]
+
+
+def _encode_body(body: Union[str, bytes, None]) -> Dict[str, str]:
+    if body is None:
+        return {}
+    if isinstance(body, str):
+        return {"text": body}
+    try:
+        return {"text": body.decode("utf8")}
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(body).decode("ascii")}
+
+
+def _decode_body(data: Dict[str, str]) -> bytes:
+    if "base64" in data:
+        return base64.b64decode(data["base64"])
+    return data.get("text", "").encode("utf8")
+
+
+class _OriginalResponse:
+    # What `requests.cookies.extract_cookies_to_jar` reads from http.client.
+    def __init__(self, headers: List[Tuple[str, str]]):
+        self.msg = HTTPMessage()
+        for name, value in headers:
+            self.msg[name] = value
+
+    def isclosed(self):
+        return True
+
+
+class Cassette:
+    """HTTP interactions saved to a gzipped json file.
+
+    In record mode, requests are sent and their responses saved. In replay
+    mode, responses are served from the cassette without network: requests
+    are matched by method, url, body and cookies, so each session gets its
+    own responses, and repeated requests get the responses in the order they
+    were recorded. Request and response headers,
+    cookies included, are saved, so sessions behave as when recorded.
+
+    Args:
+        path (Union[str, Path]): path of the cassette.
+        mode (str, optional): "record" or "replay". Defaults to "replay".
+        latency (float, optional): seconds added to each replayed response.
+            Defaults to 0.
+        realtime (bool, optional): if True, replayed responses take as long
+            as they took when recorded, plus `latency`. Defaults to False.
+    """
+
+    modes = ("record", "replay")
+
+    def __init__(
+        self, path: Union[str, Path], mode="replay", latency=0.0, realtime=False
+    ):
+        if mode not in self.modes:
+            raise ValueError(f"Invalid cassette mode: {mode!r}")
+
+        self.path = Path(path)
+        self.mode = mode
+        self.latency = latency
+        self.realtime = realtime
+
+        self.interactions: List[Dict[str, Any]] = []
+        self._replays: Dict[Key, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._lock = threading.Lock()
+
+        if mode == "replay":
+            self.load()
+
+    def __enter__(self):
+        self._previous = settings.cassette
+        settings.cassette = self
+        return self
+
+    def __exit__(self, *args):
+        settings.cassette = self._previous
+        if self.mode == "record":
+            self.save()
+
+    def load(self):
+        with gzip.open(self.path, "rt", encoding="utf8") as file_handler:
+            self.interactions = json.load(file_handler)
+        self.rewind()
+
+    def rewind(self):
+        """Replays the cassette again from the first interaction."""
+
+        self._replays.clear()
+        for interaction in self.interactions:
+            request = interaction["request"]
+            key = self.get_key(
+                request["method"],
+                request["url"],
+                request["body"],
+                request["headers"].get("Cookie", ""),
+            )
+            self._replays[key].append(interaction)
+
+    def save(self):
+        """Saves the recorded interactions."""
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            data = json.dumps(self.interactions, separators=(",", ":"))
+
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf8") as file_handler:
+            file_handler.write(data)
+        tmp_path.replace(self.path)
+
+    @staticmethod
+    def get_key(method: str, url: str, body: Dict[str, str], cookies: str) -> Key:
+        return method.upper(), url, json.dumps(body, sort_keys=True), cookies
+
+    def record(
+        self,
+        request: requests.PreparedRequest,
+        response: requests.Response,
+        elapsed: float,
+    ):
+        """Saves a request and its response."""
+
+        interaction = {
+            "request": {
+                "method": request.method,
+                "url": request.url,
+                "headers": dict(request.headers),
+                "body": _encode_body(request.body),
+            },
+            "response": {
+                "status": response.status_code,
+                "reason": response.reason,
+                "headers": self._get_raw_headers(response),
+                "body": _encode_body(response.content),
+            },
+            "elapsed": round(elapsed, 4),
+        }
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def replay(
+        self, adapter: HTTPAdapter, request: requests.PreparedRequest
+    ) -> requests.Response:
+        """Serves the recorded response of a request.
+
+        Raises:
+            CassetteMissError: if the request was not recorded.
+        """
+
+        key = self.get_key(
+            request.method,
+            request.url,
+            _encode_body(request.body),
+            request.headers.get("Cookie", ""),
+        )
+        with self._lock:
+            replays = self._replays.get(key)
+            if not replays:
+                raise CassetteMissError(request.method, request.url)
+            # The last response is served to every extra repetition.
+            interaction = replays.popleft() if len(replays) > 1 else replays[0]
+
+        delay = self.latency
+        if self.realtime:
+            delay += interaction["elapsed"]
+        if delay:
+            time.sleep(delay)
+
+        data = interaction["response"]
+        # Bodies are saved decoded, so they must not be decoded again.
+        headers = [
+            (x, y)
+            for x, y in data["headers"]
+            if x.lower() not in ("content-encoding", "content-length")
+        ]
+        raw = HTTPResponse(
+            body=io.BytesIO(_decode_body(data["body"])),
+            headers=headers,
+            status=data["status"],
+            reason=data["reason"],
+            preload_content=False,
+            decode_content=False,
+            original_response=_OriginalResponse(headers),
+        )
+        return adapter.build_response(request, raw)
+
+    @staticmethod
+    def _get_raw_headers(response: requests.Response) -> List[Tuple[str, str]]:
+        # Repeated headers, like Set-Cookie, are kept apart.
+        original = getattr(response.raw, "_original_response", None)
+        if original is not None:
+            return list(original.msg.items())
+        return list(response.headers.items())
+
+
+@contextmanager
+def use_cassette(path: Union[str, Path], mode="replay", **kwargs):
+    """Records or replays every request made with a `Downloader` in the block.
+
+    Args:
+        path (Union[str, Path]): path of the cassette.
+        mode (str, optional): "record" or "replay". Defaults to "replay".
+        **kwargs: keyword arguments passed to `Cassette`.
+    """
+
+    with Cassette(path, mode, **kwargs) as cassette:
+        yield cassette
@@ -0,0 +1,178 @@
+"""Local catalog of shops with a spatial index for nearest-shop queries."""
+
+import heapq
+import json
+import math
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .schemas import Shop
+from .utils import EARTH_RADIUS_KM, write_atomic
+
+Point = Tuple[float, float, float]
+
+
+def to_point(lat: float, long: float) -> Point:
+    """Converts coordinates to a point of the unit sphere.
+
+    The euclidean distance between two points grows with their great-circle
+    distance, so nearest neighbours can be searched in a 3-d tree.
+    """
+
+    lat, long = math.radians(lat), math.radians(long)
+    return (
+        math.cos(lat) * math.cos(long),
+        math.cos(lat) * math.sin(long),
+        math.sin(lat),
+    )
+
+
+def _squared_distance(point1: Point, point2: Point) -> float:
+    x1, y1, z1 = point1
+    x2, y2, z2 = point2
+    return (x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2
+
+
+class KDTree:
+    """Static 3-d tree over points of the unit sphere.
+
+    Args:
+        points (List[Point]): points to index. Results refer to their
+            position in this list.
+    """
+
+    def __init__(self, points: List[Point]):
+        self.points = points
+        # Each node is (point index, axis, left child, right child).
+        self.root = self._build(list(range(len(points))), 0)
+
+    def _build(self, indexes: List[int], depth: int):
+        if not indexes:
+            return None
+
+        axis = depth % 3
+        indexes.sort(key=lambda x: self.points[x][axis])
+        median = len(indexes) // 2
+        return (
+            indexes[median],
+            axis,
+            self._build(indexes[:median], depth + 1),
+            self._build(indexes[median + 1 :], depth + 1),
+        )
+
+    def nearest(self, point: Point, k=1) -> List[Tuple[float, int]]:
+        """Returns the squared distance and index of the k closest points."""
+
+        if k <= 0:
+            return []
+
+        heap: List[Tuple[float, int]] = []  # max-heap of (-distance, index)
+
+        def visit(node):
+            if node is None:
+                return
+            index, axis, left, right = node
+            squared = _squared_distance(point, self.points[index])
+            if len(heap) < k:
+                heapq.heappush(heap, (-squared, index))
+            elif squared < -heap[0][0]:
+                heapq.heapreplace(heap, (-squared, index))
+
+            delta = point[axis] - self.points[index][axis]
+            near, far = (left, right) if delta < 0 else (right, left)
+            visit(near)
+            if len(heap) < k or delta**2 < -heap[0][0]:
+                visit(far)
+
+        visit(self.root)
+        return sorted((-x, y) for x, y in heap)
+
+    def within(self, point: Point, squared_radius: float) -> List[Tuple[float, int]]:
+        """Returns the squared distance and index of the points in a radius."""
+
+        found = []
+
+        def visit(node):
+            if node is None:
+                return
+            index, axis, left, right = node
+            squared = _squared_distance(point, self.points[index])
+            if squared <= squared_radius:
+                found.append((squared, index))
+
+            delta = point[axis] - self.points[index][axis]
+            near, far = (left, right) if delta < 0 else (right, left)
+            visit(near)
+            if delta**2 <= squared_radius:
+                visit(far)
+
+        visit(self.root)
+        return sorted(found)
+
+
+class ShopCatalog:
+    """Collection of shops that answers nearest-shop queries offline.
+
+    Args:
+        shops (Iterable[Shop], optional): initial shops. Defaults to ().
+    """
+
+    def __init__(self, shops: Iterable[Shop] = ()):
+        self.shops: Dict[int, Shop] = {}
+        self._tree: Optional[KDTree] = None
+        self._tree_shops: List[Shop] = []
+        self.update(shops)
+
+    def __len__(self):
+        return len(self.shops)
+
+    def __iter__(self) -> Iterator[Shop]:
+        return iter(self.shops.values())
+
+    def __contains__(self, shop_id: int) -> bool:
+        return shop_id in self.shops
+
+    def add(self, shop: Shop):
+        self.shops[shop.id] = shop
+        self._tree = None
+
+    def update(self, shops: Iterable[Shop]):
+        for shop in shops:
+            self.add(shop)
+
+    @property
+    def tree(self) -> KDTree:
+        # The tree is rebuilt lazily after the catalog changes.
+        if self._tree is None:
+            self._tree_shops = list(self.shops.values())
+            points = [to_point(x.coords.lat, x.coords.long) for x in self._tree_shops]
+            self._tree = KDTree(points)
+        return self._tree
+
+    def nearest_shops(self, lat: float, long: float, k=1) -> List[Shop]:
+        """Returns the k shops closest to some coordinates, closest first."""
+
+        found = self.tree.nearest(to_point(lat, long), k)
+        return [self._tree_shops[index] for _, index in found]
+
+    def shops_within(self, lat: float, long: float, radius: float) -> List[Shop]:
+        """Returns the shops in a radius (km) of some coordinates, closest first."""
+
+        # Radius measured along the sphere, converted to a chord of the unit sphere.
+        angle = min(radius / EARTH_RADIUS_KM, math.pi)
+        chord = 2 * math.sin(angle / 2)
+        found = self.tree.within(to_point(lat, long), chord**2)
+        return [self._tree_shops[index] for _, index in found]
+
+    def save(self, path: Union[str, Path]):
+        """Saves the catalog as a compact json file."""
+
+        data = ",".join(shop.json(separators=(",", ":")) for shop in self)
+        write_atomic(Path(path), f"[{data}]")
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "ShopCatalog":
+        """Loads a catalog saved with `save`."""
+
+        data = json.loads(Path(path).read_text("utf8"))
+        return cls(Shop.parse_obj(x) for x in data)
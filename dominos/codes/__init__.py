@@ -1,17 +1,34 @@
+from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import List, Tuple
 
 CODES_PATH = Path(__file__).with_name("codes.txt")
 
 
-def get_codes() -> List[str]:
-    return [x.upper() for x in fix_codes()]
+def get_codes() -> Tuple[str, ...]:
+    """Returns the known codes in upper case, without modifying codes.txt.
+
+    The file is only read again when its modification time or size change.
+    """
+
+    stat = CODES_PATH.stat()
+    return _load_codes(stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=1)
+def _load_codes(mtime_ns: int, size: int) -> Tuple[str, ...]:
+    # pylint: disable=unused-argument
+    return tuple(x.upper() for x in normalize_codes(CODES_PATH.read_text("utf8")))
+
+
+def normalize_codes(text: str) -> List[str]:
+    codes = [x.lower().strip() for x in text.splitlines()]
+    return sorted(set(x for x in codes if x))
 
 
 def fix_codes() -> List[str]:
-    codes = CODES_PATH.read_text("utf8").splitlines()
-    base_codes = [x.lower().strip() for x in codes if x]
-    base_codes = list(set(base_codes))
-    base_codes.sort()
+    """Rewrites codes.txt sorted, without duplicates and in lower case."""
+
+    base_codes = normalize_codes(CODES_PATH.read_text("utf8"))
     CODES_PATH.write_text("\n".join(base_codes) + "\n", "utf-8")
     return base_codes
@@ -0,0 +1,5 @@
+from . import CODES_PATH, fix_codes
+
+if __name__ == "__main__":
+    codes = fix_codes()
+    print(f"{CODES_PATH}: {len(codes)} codes")
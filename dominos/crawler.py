@@ -0,0 +1,201 @@
+"""Crawler of every shop in the country, resumable after interruptions."""
+
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from .catalog import ShopCatalog
+from .exceptions import ShopNotFoundError
+from .locations import fetch_cities, find_shops, get_provinces
+from .networking import Downloader, RequestLimiter
+from .schemas import Shop
+from .utils import write_atomic
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILENAME = "crawl-checkpoint.json"
+CATALOG_FILENAME = "shops.json"
+
+# Streets found in most Spanish towns, usually in different neighbourhoods, so
+# that together they are served by every shop of the city.
+DEFAULT_STREETS = (
+    ("CALLE MAYOR", 1),
+    ("PLAZA MAYOR", 1),
+    ("CALLE REAL", 1),
+    ("CALLE IGLESIA", 1),
+    ("AVENIDA DE LA CONSTITUCION", 1),
+    ("CALLE SAN ROQUE", 1),
+    ("CALLE NUEVA", 1),
+    ("CALLE CERVANTES", 1),
+)
+
+
+class ShopCrawler:
+    """Enumerates provinces, cities and shops, saving progress as it goes.
+
+    The shops of each city are looked up with several streets that exist in
+    almost every Spanish town, and merged by id, since each lookup only lists
+    the shops that serve that street. Progress is saved after every city to a checkpoint in
+    the folder, so an interrupted crawl continues where it stopped.
+
+    Args:
+        folder (Union[str, Path]): folder of the checkpoint and the catalog.
+        max_workers (int, optional): number of cities crawled concurrently.
+            Defaults to 4.
+        max_requests (int, optional): maximum number of in-flight requests.
+            If none, it's set to max_workers. Defaults to None.
+        refresh_cities (bool, optional): if True, the cities of each province
+            are downloaded instead of read from the locations file.
+            Defaults to False.
+        streets (Sequence[Tuple[str, int]], optional): street names and
+            numbers used to look up the shops of each city. Defaults to
+            `DEFAULT_STREETS`.
+    """
+
+    def __init__(
+        self,
+        folder: Union[str, Path],
+        max_workers=4,
+        max_requests: Optional[int] = None,
+        refresh_cities=False,
+        streets: Sequence[Tuple[str, int]] = DEFAULT_STREETS,
+    ):
+        self.folder = Path(folder)
+        self.max_workers = max_workers
+        self.limiter = RequestLimiter(max_requests or max_workers)
+        self.refresh_cities = refresh_cities
+        self.streets = streets
+
+        self.checkpoint_path = self.folder / CHECKPOINT_FILENAME
+        self.catalog_path = self.folder / CATALOG_FILENAME
+        self.done: Set[str] = set()
+        self.catalog = ShopCatalog()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def downloader(self) -> Downloader:
+        # requests sessions are not thread-safe, so each worker gets its own.
+        if not hasattr(self._local, "downloader"):
+            self._local.downloader = Downloader(limiter=self.limiter)
+        return self._local.downloader
+
+    def load_checkpoint(self):
+        if not self.checkpoint_path.exists():
+            return
+
+        data = json.loads(self.checkpoint_path.read_text("utf8"))
+        self.done = set(data["done"])
+        self.catalog.update(Shop.parse_obj(x) for x in data["shops"])
+        logger.info(
+            "Resuming crawl: %d cities done, %d shops",
+            len(self.done),
+            len(self.catalog),
+        )
+
+    def save_checkpoint(self):
+        with self._lock:
+            shops = ",".join(x.json(separators=(",", ":")) for x in self.catalog)
+            done = json.dumps(sorted(self.done), ensure_ascii=False)
+            write_atomic(self.checkpoint_path, f'{{"done":{done},"shops":[{shops}]}}')
+
+    def get_cities(self) -> List[Tuple[str, int, str, str]]:
+        """Returns (province, province id, city, city id) of every city."""
+
+        provinces = get_provinces()
+
+        if self.refresh_cities:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {
+                    name: executor.submit(self.fetch_cities, data["id"])
+                    for name, data in provinces.items()
+                }
+                cities_by_province = {x: y.result() for x, y in futures.items()}
+        else:
+            cities_by_province = {x: y["cities"] for x, y in provinces.items()}
+
+        return [
+            (province, provinces[province]["id"], city, city_id)
+            for province, cities in cities_by_province.items()
+            for city, city_id in cities.items()
+        ]
+
+    def fetch_cities(self, province_id: int) -> Dict[str, str]:
+        return fetch_cities(province_id, session=self.downloader)
+
+    def crawl_city(self, province_id: int, city_id: str) -> List[Shop]:
+        shops: Dict[int, Shop] = {}
+        for street_name, street_number in self.streets:
+            try:
+                found = find_shops(
+                    province_id,
+                    city_id,
+                    street_name,
+                    street_number,
+                    session=self.downloader,
+                )
+            except ShopNotFoundError:
+                continue
+            for shop in found:
+                shops.setdefault(shop.id, shop)
+        return list(shops.values())
+
+    def run(self) -> ShopCatalog:
+        """Crawls the cities not crawled yet and saves the catalog.
+
+        Returns:
+            ShopCatalog: every shop found, deduplicated by id.
+        """
+
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.load_checkpoint()
+
+        pending = [
+            x for x in self.get_cities() if self.get_key(x[0], x[2]) not in self.done
+        ]
+        total = len(pending)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {}
+            for province, province_id, city, city_id in pending:
+                future = executor.submit(self.crawl_city, province_id, city_id)
+                futures[future] = (province, city)
+
+            for n_done, future in enumerate(as_completed(futures), start=1):
+                province, city = futures[future]
+                try:
+                    shops = future.result()
+                except Exception:  # pylint: disable=broad-except
+                    # Not marked as done, so it's retried when resuming.
+                    logger.exception("Error crawling %s, %s", city, province)
+                    continue
+
+                with self._lock:
+                    self.catalog.update(shops)
+                    self.done.add(self.get_key(province, city))
+                self.save_checkpoint()
+                logger.info(
+                    "Crawled %s, %s: %d shops (%d/%d)",
+                    city,
+                    province,
+                    len(shops),
+                    n_done,
+                    total,
+                )
+
+        with self._lock:
+            self.catalog.save(self.catalog_path)
+        return self.catalog
+
+    @staticmethod
+    def get_key(province: str, city: str) -> str:
+        return f"{province}|{city}"
+
+
+def crawl_shops(folder: Union[str, Path], **kwargs) -> ShopCatalog:
+    """Crawls every shop, see `ShopCrawler` for the arguments."""
+
+    return ShopCrawler(folder, **kwargs).run()
@@ -0,0 +1,313 @@
+"""Long-running refresh of the shops, the most stale and changing ones first."""
+
+import heapq
+import json
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from dominos.cache import DAY, Journal, ResultCache, ShopCache
+from dominos.exceptions import StoppedError
+from dominos.main import SessionPool, update_shop
+from dominos.networking import RequestLimiter, settings
+from dominos.schemas import Address, Information
+from dominos.utils import write_atomic
+
+logger = logging.getLogger(__name__)
+
+STATE_FILENAME = "refresh-state.json"
+
+
+def get_codes_set(info: Information) -> Set[Tuple[str, str]]:
+    return {(x, y.code) for x, codes in info.order_types.items() for y in codes}
+
+
+def get_churn(old: Information, new: Information) -> float:
+    """Returns the fraction of working codes that changed between two updates."""
+
+    old_codes, new_codes = get_codes_set(old), get_codes_set(new)
+    union = old_codes | new_codes
+    if not union:
+        return 0.0
+    return len(old_codes ^ new_codes) / len(union)
+
+
+class ShopState:
+    """What the daemon remembers of each address between refreshes."""
+
+    def __init__(self, address: Address, name_alias: Optional[str] = None, churn=0.0):
+        self.address = address
+        self.name_alias = name_alias
+        self.churn = churn
+        self.updated: Optional[float] = None
+        self.information: Optional[Information] = None
+        self.failures = 0
+
+    def to_dict(self):
+        return {"name_alias": self.name_alias, "churn": self.churn}
+
+
+class RefreshDaemon:
+    """Refreshes the shops of some addresses forever, most urgent first.
+
+    Each shop is due `interval` seconds after its last update, as read from
+    its `Information` file, shortened for the shops whose codes change often:
+    the interval is divided by `1 + churn_weight * churn`, where churn is the
+    moving average of the fraction of working codes that changed in each
+    refresh. Shops never updated are due right away.
+
+    The churn of each shop and the refreshes in flight are saved to a state
+    file in the base folder after each refresh, and the codes checked to a
+    `Journal` in the base folder. On SIGINT or SIGTERM no more refreshes are
+    started, the ones in flight stop after the code being checked and the
+    state is saved. Refreshes interrupted by a signal or a crash are due first
+    on restart and skip the codes already checked.
+
+    Args:
+        addresses (Iterable[Address]): addresses of the shops.
+        base_folder (Union[str, Path]): folder of the shops information.
+        interval (float, optional): seconds between refreshes of a shop whose
+            codes never change. Defaults to 1 day.
+        churn_weight (float, optional): how much sooner changing shops are
+            refreshed. Defaults to 3.
+        max_workers (int, optional): number of shops refreshed concurrently.
+            Defaults to 1.
+        rate_limit (float, optional): maximum requests per second of the
+            whole process, see `dominos.networking.Throttle`. If none, the
+            current setting is kept. Defaults to None.
+        retry_delay (float, optional): seconds before retrying a shop whose
+            refresh failed, doubled after each consecutive failure up to
+            `interval`. Defaults to 15 minutes.
+        cache (bool, optional): if True, a `ResultCache` in the base folder
+            skips the codes that failed recently. Defaults to False.
+    """
+
+    churn_smoothing = 0.5
+
+    def __init__(
+        self,
+        addresses: Iterable[Address],
+        base_folder: Union[str, Path],
+        interval: float = DAY,
+        churn_weight=3.0,
+        max_workers=1,
+        rate_limit: Optional[float] = None,
+        retry_delay: float = 15 * 60,
+        cache=False,
+    ):
+        self.base_folder = Path(base_folder).absolute()
+        self.interval = interval
+        self.churn_weight = churn_weight
+        self.max_workers = max_workers
+        self.rate_limit = rate_limit
+        self.retry_delay = retry_delay
+        self.use_cache = cache
+
+        self.state_path = self.base_folder / STATE_FILENAME
+        self.shops: Dict[str, ShopState] = {}
+        for address in addresses:
+            self.shops[ShopCache.get_key(address)] = ShopState(address)
+
+        self._queue: List[Tuple[float, int, str]] = []
+        self._counter = 0
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+    def stop(self):
+        """Stops starting refreshes. `run` returns when the in-flight end."""
+
+        self._stop.set()
+        self._wake.set()
+
+    def get_due(self, shop: ShopState) -> float:
+        if shop.updated is None:
+            return 0.0
+        return shop.updated + self.interval / (1 + self.churn_weight * shop.churn)
+
+    def push(self, key: str, due: float):
+        self._counter += 1
+        heapq.heappush(self._queue, (due, self._counter, key))
+
+    def load_state(self, shop_cache: ShopCache):
+        """Reads the saved state and the last update of each shop.
+
+        Args:
+            shop_cache (ShopCache): cache of the shops, used to find the
+                files of the addresses missing in the state. Shops not cached
+                are looked up and cached.
+        """
+
+        state = {}
+        if self.state_path.exists():
+            state = json.loads(self.state_path.read_text("utf8"))
+
+        for key, shop in self.shops.items():
+            saved = state.get("shops", {}).get(key, {})
+            shop.name_alias = saved.get("name_alias")
+            shop.churn = saved.get("churn", 0.0)
+            if not shop.name_alias and not self._stop.is_set():
+                try:
+                    shop.name_alias = shop_cache.get_shop(shop.address).name_alias
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception("Error finding shop of %s", shop.address)
+
+            shop.information = self.read_information(shop)
+            if shop.information and key not in state.get("in_flight", []):
+                shop.updated = shop.information.updated.timestamp()
+            self.push(key, self.get_due(shop))
+
+    def save_state(self):
+        with self._lock:
+            state = {
+                "shops": {x: y.to_dict() for x, y in self.shops.items()},
+                "in_flight": sorted(self._in_flight),
+            }
+        write_atomic(self.state_path, json.dumps(state, ensure_ascii=False, indent=4))
+
+    def read_information(self, shop: ShopState) -> Optional[Information]:
+        if not shop.name_alias:
+            return None
+        path = self.base_folder / f"{shop.name_alias}.txt"
+        if not path.exists():
+            return None
+        return Information.parse_raw(path.read_text("utf8"))
+
+    def run(self):
+        """Refreshes the shops until `stop` is called or a signal is received."""
+
+        # The shop lookups of load_state are rate limited too.
+        previous_rate_limit = settings.rate_limit
+        if self.rate_limit is not None:
+            settings.rate_limit = self.rate_limit
+        try:
+            self._run()
+        finally:
+            settings.rate_limit = previous_rate_limit
+
+    def _run(self):
+        self.base_folder.mkdir(parents=True, exist_ok=True)
+        # Installed first, so a signal also stops the shop lookups of load_state.
+        previous_handlers = self._install_signal_handlers()
+        shop_cache = ShopCache.in_folder(self.base_folder)
+        try:
+            self.load_state(shop_cache)
+            self._refresh(shop_cache)
+        finally:
+            shop_cache.close()
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+    def _refresh(self, shop_cache: ShopCache):
+        limiter = RequestLimiter(self.max_workers)
+        cache = ResultCache.in_folder(self.base_folder) if self.use_cache else None
+        # Progress older than a refresh interval is stale.
+        journal = Journal.in_folder(self.base_folder, ttl=self.interval)
+        pool = SessionPool(workers=2 * self.max_workers, limiter=limiter)
+
+        try:
+            with pool, ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                while not self._stop.is_set():
+                    self._start_due(executor, pool, limiter, shop_cache, cache, journal)
+                    self._wake.wait(self._get_timeout())
+                    self._wake.clear()
+
+                logger.info("Stopping, waiting for %d shops", len(self._in_flight))
+        finally:
+            self.save_state()
+            journal.close()
+            if cache:
+                cache.close()
+
+    def _get_timeout(self) -> Optional[float]:
+        with self._lock:
+            if len(self._in_flight) >= self.max_workers or not self._queue:
+                return None
+            return max(0.0, self._queue[0][0] - time.time())
+
+    def _start_due(self, executor, pool, limiter, shop_cache, cache, journal):
+        while True:
+            with self._lock:
+                if len(self._in_flight) >= self.max_workers or not self._queue:
+                    return
+                due, _, key = self._queue[0]
+                if due > time.time():
+                    return
+                heapq.heappop(self._queue)
+
+                shop = self.shops[key]
+                future = executor.submit(
+                    update_shop,
+                    shop.address,
+                    self.base_folder,
+                    limiter=limiter,
+                    pool=pool,
+                    cache=cache,
+                    shop_cache=shop_cache,
+                    journal=journal,
+                    stop=self._stop,
+                )
+                self._in_flight[key] = future
+
+            logger.info("Refreshing shop of %s", shop.address)
+            self.save_state()
+            future.add_done_callback(lambda x, key=key: self._on_done(key, x, journal))
+
+    def _on_done(self, key: str, future: Future, journal: Optional[Journal] = None):
+        shop = self.shops[key]
+        now = time.time()
+
+        try:
+            info = future.result()
+        except StoppedError:
+            # Left in flight, so it's due first on restart.
+            logger.info("Stopped refreshing %s", shop.address)
+            return
+        except Exception:  # pylint: disable=broad-except
+            shop.failures += 1
+            delay = min(self.retry_delay * 2 ** (shop.failures - 1), self.interval)
+            logger.exception("Error refreshing %s, retry in %ds", shop.address, delay)
+            due = now + delay
+        else:
+            if journal:
+                # Finished, so the next refresh starts over.
+                journal.forget_shop(shop.address, info.shop.id)
+            if shop.information:
+                churn = get_churn(shop.information, info)
+                alpha = self.churn_smoothing
+                shop.churn = alpha * churn + (1 - alpha) * shop.churn
+            shop.information = info
+            shop.name_alias = info.shop.name_alias
+            shop.updated = now
+            shop.failures = 0
+            due = self.get_due(shop)
+            logger.info(
+                "Refreshed %s (churn %.2f), next in %.0fs",
+                shop.name_alias,
+                shop.churn,
+                due - now,
+            )
+
+        with self._lock:
+            del self._in_flight[key]
+            self.push(key, due)
+        self.save_state()
+        self._wake.set()
+
+    def _install_signal_handlers(self):
+        if threading.current_thread() is not threading.main_thread():
+            return {}
+
+        def handler(signum, frame):
+            logger.warning("Received signal %d, shutting down gracefully", signum)
+            self.stop()
+
+        previous = {}
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            previous[signum] = signal.signal(signum, handler)
+        return previous
@@ -0,0 +1,56 @@
+import argparse
+import json
+import logging
+from pathlib import Path
+
+from dominos.schemas import Address
+
+from . import RefreshDaemon
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m dominos.daemon",
+        description="Refreshes the codes of some shops forever, most stale first.",
+    )
+    parser.add_argument(
+        "addresses", type=Path, help="JSON file with a list of addresses"
+    )
+    parser.add_argument("--base-folder", type=Path, default=Path("dominos-codes"))
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=24,
+        help="hours between refreshes of a shop whose codes don't change",
+    )
+    parser.add_argument(
+        "--churn-weight",
+        type=float,
+        default=3.0,
+        help="how much sooner shops whose codes change are refreshed",
+    )
+    parser.add_argument("--workers", type=int, default=1, help="concurrent shops")
+    parser.add_argument("--rate-limit", type=float, help="max requests per second")
+    parser.add_argument(
+        "--cache", action="store_true", help="skip the codes that failed recently"
+    )
+    args = parser.parse_args()
+
+    data = json.loads(args.addresses.read_text("utf8"))
+    addresses = [Address(**x) for x in data]
+
+    logging.basicConfig(level=logging.INFO)
+    daemon = RefreshDaemon(
+        addresses,
+        args.base_folder,
+        interval=args.interval * 3600,
+        churn_weight=args.churn_weight,
+        max_workers=args.workers,
+        rate_limit=args.rate_limit,
+        cache=args.cache,
+    )
+    daemon.run()
+
+
+if __name__ == "__main__":
+    main()
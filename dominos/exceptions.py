@@ -4,3 +4,27 @@ class DominosError(Exception):
 
 class DownloaderError(DominosError):
     ...
+
+
+class CircuitOpenError(DownloaderError):
+    ...
+
+
+class SessionExpiredError(DominosError):
+    ...
+
+
+class StoppedError(DominosError):
+    ...
+
+
+class CityNotFoundError(DominosError, RuntimeError):
+    ...
+
+
+class ShopNotFoundError(DominosError, RuntimeError):
+    ...
+
+
+class CassetteMissError(DominosError, LookupError):
+    ...
@@ -0,0 +1,314 @@
+"""Local stand-in of dominospizza.es, to test the checkers without production.
+
+It implements the endpoints used by the package with payloads shaped like the
+real ones: the promotions page with its anti-forgery form, order sessions,
+promotional codes, the shops of each city and the cities of each province.
+"""
+
+import asyncio
+import hashlib
+import logging
+import random
+import secrets
+import threading
+from datetime import date, timedelta
+from functools import lru_cache
+from html import escape
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+from dominos.locations import get_provinces
+from dominos.networking import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VALID_CODES = {
+    "10FAM": "Pizza mediana familiar por 10€",
+    "1126": "2 pizzas medianas por 11,26€",
+    "2X1DOM": "2x1 en pizzas a domicilio",
+}
+
+SESSION_COOKIE = "ASP.NET_SessionId"
+
+_TOKEN_FORM = (
+    '<form id="__AjaxAntiForgeryForm" action="#" method="post">'
+    '<input name="__RequestVerificationToken" type="hidden" value="{token}" />'
+    "</form>"
+)
+_PROMOTION = (
+    '<div class="promo-content"><h3>{description}</h3>'
+    '<div class="promo-description">Promoción válida hasta el {expires}.</div>'
+    "</div>"
+)
+_SHOP = (
+    '<li class="tienda" data-idtienda="{id}" data-latitude="{lat:.6f}" '
+    'data-longitude="{long:.6f}"><div class="fl w50">'
+    "<h5>Tienda {street}, {number}, {postal_code}, {city}</h5>"
+    "<p>Teléfono: {phone}</p><p>Horario: {schedule}</p></div>"
+    '<div class="fr w50">{buttons}</div></li>'
+)
+_ERROR_PAGE = (
+    "<!DOCTYPE html><html><head><title>Error</title></head><body>"
+    "<h1>Lo sentimos, se ha producido un error.</h1></body></html>"
+)
+
+
+@lru_cache(maxsize=None)
+def _get_city_names() -> Dict[str, str]:
+    return {
+        city_id: city
+        for province in get_provinces().values()
+        for city, city_id in province["cities"].items()
+    }
+
+
+class _Session:
+    def __init__(self):
+        self.token = secrets.token_urlsafe(32)
+        self.shop_id: Optional[int] = None
+        self.order_type: Optional[str] = None
+        self.applied: List[str] = []
+
+
+class FakeServer:
+    """Fake dominospizza.es server running in a background thread.
+
+    Used as a context manager, `settings.base_url` points to the server while
+    it's running, so every part of the package talks to it.
+
+    Args:
+        valid_codes (Dict[str, str], optional): description of the promotion
+            of each valid code. Defaults to `DEFAULT_VALID_CODES`.
+        latency (float, optional): seconds each response takes.
+            Defaults to 0.
+        jitter (float, optional): maximum random seconds added to the
+            latency. Defaults to 0.
+        error_rate (float, optional): fraction of the requests answered with
+            a 503 error. Defaults to 0.
+        seed (int, optional): seed of the random errors and jitter.
+            Defaults to None.
+    """
+
+    def __init__(
+        self,
+        valid_codes: Optional[Dict[str, str]] = None,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        seed: Optional[int] = None,
+    ):
+        if valid_codes is None:
+            valid_codes = DEFAULT_VALID_CODES
+        self.valid_codes = valid_codes
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+        self.requests: Dict[str, int] = {}
+        self.sessions: Dict[str, _Session] = {}
+        self.url: Optional[str] = None
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+        self._previous_base_url: Optional[str] = None
+
+    def __enter__(self):
+        self.start()
+        self._previous_base_url = settings.base_url
+        settings.base_url = self.url
+        return self
+
+    def __exit__(self, *args):
+        settings.base_url = self._previous_base_url
+        self.stop()
+
+    def create_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get("/promociones", self.promotions)
+        app.router.add_post("/Pedido/IniciarPedidoSession", self.start_order)
+        app.router.add_post("/Promocion/AplicarCodPromo", self.apply_code)
+        app.router.add_post("/Tienda/BuscarTiendas", self.find_shops)
+        app.router.add_post("/Tienda/GetLocalidadesJson", self.get_cities)
+        return app
+
+    def start(self, host="127.0.0.1", port=0) -> str:
+        """Starts the server in a background thread.
+
+        Args:
+            host (str, optional): host to bind. Defaults to "127.0.0.1".
+            port (int, optional): port to bind. If 0, a free port is used.
+                Defaults to 0.
+
+        Returns:
+            str: base url of the server.
+        """
+
+        self._loop = asyncio.new_event_loop()
+        # Requests still in flight when stopping don't keep it waiting long.
+        self._runner = web.AppRunner(
+            self.create_app(), access_log=None, shutdown_timeout=1
+        )
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, host, port)
+        self._loop.run_until_complete(site.start())
+
+        bound_host, bound_port = self._runner.addresses[0][:2]
+        self.url = f"http://{bound_host}:{bound_port}/"
+
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="dominos-fakeserver", daemon=True
+        )
+        self._thread.start()
+        logger.info("Fake server listening on %s", self.url)
+        return self.url
+
+    def stop(self):
+        if self._loop is None:
+            return
+
+        future = asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop)
+        future.result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        self.requests[request.path] = self.requests.get(request.path, 0) + 1
+
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            return web.Response(status=503, text=_ERROR_PAGE, content_type="text/html")
+
+        return await handler(request)
+
+    def _get_session(self, request: web.Request) -> Optional[_Session]:
+        return self.sessions.get(request.cookies.get(SESSION_COOKIE, ""))
+
+    def _new_session(self, response: web.StreamResponse) -> _Session:
+        session_id = secrets.token_hex(12)
+        session = self.sessions[session_id] = _Session()
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True)
+        return session
+
+    def _render_promotions(self, session: _Session) -> str:
+        expires = date.today() + timedelta(days=30)
+        return "".join(
+            _PROMOTION.format(
+                description=escape(self.valid_codes[code]),
+                expires=expires.strftime("%d/%m/%Y"),
+            )
+            for code in session.applied
+        )
+
+    async def promotions(self, request: web.Request) -> web.Response:
+        response = web.Response(content_type="text/html")
+        session = self._get_session(request) or self._new_session(response)
+
+        response.text = (
+            "<!DOCTYPE html><html><head><title>Promociones | Domino's Pizza</title>"
+            '</head><body><div id="promociones">'
+            f"{_TOKEN_FORM.format(token=session.token)}"
+            f'<div class="promo-list">{self._render_promotions(session)}</div>'
+            "</div></body></html>"
+        )
+        return response
+
+    async def start_order(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        response = web.json_response({"result": True})
+        session = self._get_session(request) or self._new_session(response)
+
+        try:
+            session.shop_id = int(data["idTienda"])
+            session.order_type = data["tipoPedido"].lower()
+        except (KeyError, ValueError):
+            return web.json_response({"result": False})
+
+        session.applied.clear()
+        return response
+
+    async def apply_code(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        session = self._get_session(request)
+
+        # Like the real site, bad sessions and tokens get an HTML error page.
+        if (
+            session is None
+            or session.shop_id is None
+            or data.get("__RequestVerificationToken") != session.token
+        ):
+            return web.Response(text=_ERROR_PAGE, content_type="text/html")
+
+        code = data.get("CodPromo", "").strip().upper()
+        if code not in self.valid_codes or code in session.applied:
+            return web.json_response(
+                {"result": False, "message": "El código introducido no es válido"}
+            )
+
+        session.applied.append(code)
+        return web.json_response({"result": True, "message": ""})
+
+    async def find_shops(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        city_id = data.get("idLocalidad", "")
+        city = self._get_city_name(city_id)
+        if city is None:
+            return web.json_response({"result": False, "message": "Sin tiendas"})
+
+        shops = "".join(
+            self._render_shop(city_id, city, n) for n in range(self._n_shops(city_id))
+        )
+        return web.Response(
+            text=f'<div class="tiendas"><ul class="listTiendas">{shops}</ul></div>',
+            content_type="text/html",
+        )
+
+    async def get_cities(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        for province in get_provinces().values():
+            if str(province["id"]) == data.get("provinciaId"):
+                cities = province["cities"].items()
+                return web.json_response([{"Text": x, "Value": y} for x, y in cities])
+        return web.json_response([])
+
+    @staticmethod
+    def _get_city_name(city_id: str) -> Optional[str]:
+        return _get_city_names().get(city_id)
+
+    @staticmethod
+    def _seed(*parts) -> random.Random:
+        # Stable between runs, unlike hash().
+        digest = hashlib.sha256("|".join(map(str, parts)).encode()).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def _n_shops(self, city_id: str) -> int:
+        return self._seed(city_id).randint(1, 3)
+
+    def _render_shop(self, city_id: str, city: str, n: int) -> str:
+        rng = self._seed(city_id, n)
+        order_types = [("recoger", "Recoger")]
+        if rng.random() < 0.9:
+            order_types.append(("domicilio", "A domicilio"))
+        buttons = "".join(
+            f'<button class="btn" name="{x}" type="submit">{y}</button>'
+            for x, y in order_types
+        )
+        return _SHOP.format(
+            id=int(city_id) * 10 + n,
+            lat=rng.uniform(36.0, 43.5),
+            long=rng.uniform(-9.0, 3.3),
+            street=rng.choice(["Calle Mayor", "Avenida de la Paz", "Calle Real"]),
+            number=rng.randint(1, 200),
+            postal_code=f"{rng.randint(1000, 52999):05d}",
+            city=escape(city.title()),
+            phone=rng.randint(900000000, 999999999),
+            schedule="L-D: 12:00 - 00:00",
+            buttons=buttons,
+        )
@@ -0,0 +1,55 @@
+import argparse
+import logging
+import time
+
+from . import DEFAULT_VALID_CODES, FakeServer
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m dominos.fakeserver",
+        description="Runs a fake dominospizza.es server for local testing.",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds each response takes"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="maximum random extra latency"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="fraction of 503 responses"
+    )
+    parser.add_argument(
+        "--codes", nargs="+", help="valid codes (defaults to a few sample codes)"
+    )
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    valid_codes = DEFAULT_VALID_CODES
+    if args.codes:
+        valid_codes = {x.upper(): f"Promoción {x.upper()}" for x in args.codes}
+
+    logging.basicConfig(level=logging.INFO)
+    server = FakeServer(
+        valid_codes,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    url = server.start(args.host, args.port)
+    print(f"Serving on {url}, set DOMINOS_BASE_URL={url} to use it")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,119 @@
 from dominos.schemas import Address, Coords, OrderType, Shop
 import json
+import marshal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from urllib.parse import urljoin
+from typing import Any, Dict, List, Optional, Tuple
 
 from bs4 import BeautifulSoup
-from dominos.networking import downloader
-from dominos.utils import BASE_URL
+from dominos import metrics
+from dominos.exceptions import CityNotFoundError, ShopNotFoundError
+from dominos.networking import Downloader, RequestLimiter, downloader, get_url
+from dominos.parsing import parse_elements
+from dominos.utils import write_atomic
+
+from .fuzzy import CityCandidate, CityIndex, normalize_name
 
 json_path = Path(__file__).with_name("provinces-cities-ids.json")
+province_ids_path = Path(__file__).with_name("province-ids.json")
+compiled_path = json_path.with_suffix(".marshal")
 
+FUZZY_MIN_SCORE = 0.8
 
-def get_shop_by_address(address: Address):
-    data = json.loads(json_path.read_text("utf8"))
 
-    for province_name, province_data in data.items():
-        if province_name != address.province:
-            continue
-        for city_name, city_id in province_data["cities"].items():
-            if city_name == address.city:
-                return find_closest_shop(
-                    province_data["id"],
-                    city_id,
-                    address.street_name,
-                    address.street_number,
-                )
+def get_shop_by_address(address: Address, strict=True):
+    """Finds the shop closest to an address.
+
+    Args:
+        address (Address): address.
+        strict (bool, optional): if False and the city is not found, the most
+            similar city of the province is used, if similar enough.
+            Defaults to True.
+
+    Raises:
+        CityNotFoundError: if the city can't be resolved.
+
+    Returns:
+        Shop: closest shop.
+    """
+
+    province_id, city_id = resolve_city(address.province, address.city, strict)
+    return find_closest_shop(
+        province_id, city_id, address.street_name, address.street_number
+    )
+
+
+def resolve_city(province: str, city: str, strict=True) -> Tuple[int, str]:
+    """Returns the province and city ids of a city.
+
+    Args:
+        province (str): name of the province.
+        city (str): name of the city.
+        strict (bool, optional): if False and the city is not found, the most
+            similar city of the province is used, if similar enough.
+            Defaults to True.
+
+    Raises:
+        CityNotFoundError: if the city can't be resolved.
+
+    Returns:
+        Tuple[int, str]: province id and city id.
+    """
+
+    key = (normalize_name(province), normalize_name(city))
+    try:
+        return get_city_index()[key]
+    except KeyError:
+        pass
+
+    candidates = search_cities(city, province)
+    if not strict and candidates and candidates[0].score >= FUZZY_MIN_SCORE:
+        return candidates[0].province_id, candidates[0].city_id
+
+    suggestions = ", ".join(repr(x.city) for x in candidates)
+    raise CityNotFoundError(
+        f"City not found: {province}, {city}. Did you mean: {suggestions}?"
+    )
+
 
-    raise RuntimeError()
+def search_cities(city: str, province=None, limit=5) -> List[CityCandidate]:
+    """Finds the known cities most similar to a name, best first."""
+
+    return get_city_search_index().search(city, province, limit=limit)
 
 
 def find_closest_shop(province_id, city_id, street_name, street_number):
+    return find_shops(province_id, city_id, street_name, street_number)[0]
+
+
+def find_shops(
+    province_id,
+    city_id,
+    street_name,
+    street_number,
+    session: Optional[Downloader] = None,
+) -> List[Shop]:
+    """Finds the shops that serve a street, closest first.
+
+    Args:
+        province_id (int): id of the province.
+        city_id (str): id of the city.
+        street_name (str): name of the street.
+        street_number (int): number of the street.
+        session (Downloader, optional): downloader used instead of the shared
+            one. Defaults to None.
+
+    Raises:
+        ShopNotFoundError: if there are no shops for the address.
+
+    Returns:
+        List[Shop]: shops listed for the address.
+    """
+
+    session = session or downloader
     payload = {
         "idProvincia": province_id,
         "idLocalidad": city_id,
@@ -37,17 +122,21 @@ def find_closest_shop(province_id, city_id, street_name, street_number):
         "guardarDireccion": False,
     }
 
-    url = urljoin(BASE_URL, "Tienda/BuscarTiendas")
+    url = get_url("Tienda/BuscarTiendas")
 
-    response = downloader.post(url, data=payload)
+    response = session.post(url, data=payload)
     if response.headers["content-type"].split(";")[0] == "application/json":
         if response.json()["result"] is False:
-            raise RuntimeError(payload, response.json())
-
-    soup = BeautifulSoup(response.text, "html.parser")
-    shop = soup.find("ul", class_="listTiendas").find("li")
+            raise ShopNotFoundError(payload, response.json())
 
-    return build_shop_from_soup(shop)
+    with metrics.timed("dominos_parse_seconds", parser="shops"):
+        shops_lists = parse_elements(response.text, "ul", class_="listTiendas")
+        shops = []
+        if shops_lists:
+            shops = shops_lists[0].find_all("li", attrs={"data-idtienda": True})
+        if not shops:
+            raise ShopNotFoundError(payload)
+        return [build_shop_from_soup(x) for x in shops]
 
 
 def build_shop_from_soup(soup: BeautifulSoup):
@@ -73,14 +162,158 @@ def build_shop_from_soup(soup: BeautifulSoup):
     )
 
 
-def get_provinces():
+@lru_cache(maxsize=None)
+def get_provinces() -> Dict[str, Any]:
+    """Returns the provinces and their cities. The result is shared by all
+    the callers, so it must not be modified.
+
+    The precompiled marshal file is used if it was compiled by this python
+    version and it's up to date with the json file, if any.
+    """
+
+    if compiled_path.exists():
+        if not json_path.exists() or (
+            compiled_path.stat().st_mtime >= json_path.stat().st_mtime
+        ):
+            data = load_compiled_provinces(compiled_path)
+            if data is not None:
+                return data
     return json.loads(json_path.read_text("utf8"))
 
 
-def get_codes():
-    url = urljoin(BASE_URL, "Tienda/GetLocalidadesJson")
-    provinces = {}
-    for province_name, province_id in get_provinces().items():
-        response = downloader.post(url, data={"provinciaId": province_id})
-        cities = {x["Text"]: x["Value"] for x in response.json()}
-        provinces[province_name] = {"id": province_id, "cities": cities}
+@lru_cache(maxsize=None)
+def get_city_index() -> Dict[Tuple[str, str], Tuple[int, str]]:
+    """Returns the province and city ids by normalized (province, city)."""
+
+    index = {}
+    for province_name, province_data in get_provinces().items():
+        for city_name, city_id in province_data["cities"].items():
+            key = (normalize_name(province_name), normalize_name(city_name))
+            index[key] = (province_data["id"], city_id)
+    return index
+
+
+@lru_cache(maxsize=None)
+def get_city_search_index() -> CityIndex:
+    return CityIndex(get_provinces())
+
+
+def fetch_cities(province_id, session: Optional[Downloader] = None) -> Dict[str, str]:
+    """Downloads the cities with shops of a province.
+
+    Args:
+        province_id (int): id of the province.
+        session (Downloader, optional): downloader used instead of the shared
+            one. Defaults to None.
+
+    Returns:
+        Dict[str, str]: city ids by city name.
+    """
+
+    session = session or downloader
+    url = get_url("Tienda/GetLocalidadesJson")
+    response = session.post(url, data={"provinciaId": province_id})
+    return {x["Text"]: x["Value"] for x in response.json()}
+
+
+def compile_provinces(path: Path = compiled_path):
+    """Precompiles the provinces json file into a faster to load marshal file.
+
+    The marshal format may change between python versions, so the file starts
+    with the version that wrote it, see `load_compiled_provinces`.
+    """
+
+    data = json.loads(json_path.read_text("utf8"))
+    path.write_bytes(marshal.dumps((sys.implementation.cache_tag, data)))
+
+
+def load_compiled_provinces(path: Path = compiled_path) -> Optional[Dict[str, Any]]:
+    """Returns the provinces of the marshal file, or None if it can't be used
+    by this python version."""
+
+    try:
+        cache_tag, data = marshal.loads(path.read_bytes())
+    except (EOFError, ValueError, TypeError):
+        return None
+    if cache_tag != sys.implementation.cache_tag:
+        return None
+    return data
+
+
+def get_province_ids() -> Dict[str, int]:
+    return json.loads(province_ids_path.read_text("utf8"))
+
+
+def fetch_provinces(max_workers=8, max_requests: Optional[int] = None):
+    """Downloads the cities of every province concurrently.
+
+    Args:
+        max_workers (int, optional): number of provinces downloaded at the
+            same time. Defaults to 8.
+        max_requests (int, optional): maximum number of in-flight requests.
+            If none, it's set to max_workers. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: provinces and their cities, with the same format as
+            the locations file.
+    """
+
+    limiter = RequestLimiter(max_requests or max_workers)
+    local = threading.local()
+
+    def fetch(province_id):
+        if not hasattr(local, "downloader"):
+            local.downloader = Downloader(limiter=limiter)
+        cities = fetch_cities(province_id, session=local.downloader)
+        return {"id": province_id, "cities": dict(sorted(cities.items()))}
+
+    province_ids = get_province_ids()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {x: executor.submit(fetch, y) for x, y in province_ids.items()}
+        return {x: y.result() for x, y in futures.items()}
+
+
+def diff_provinces(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, List[str]]:
+    """Compares two versions of the provinces data.
+
+    Returns:
+        Dict[str, List[str]]: "province: city" of the cities added, removed
+            and whose id changed.
+    """
+
+    diff = {"added": [], "removed": [], "changed": []}
+    for province in sorted(set(old) | set(new)):
+        old_cities = old.get(province, {}).get("cities", {})
+        new_cities = new.get(province, {}).get("cities", {})
+        for city in sorted(set(old_cities) | set(new_cities)):
+            if city not in old_cities:
+                diff["added"].append(f"{province}: {city}")
+            elif city not in new_cities:
+                diff["removed"].append(f"{province}: {city}")
+            elif old_cities[city] != new_cities[city]:
+                diff["changed"].append(f"{province}: {city}")
+    return diff
+
+
+def regenerate_provinces(dry_run=False, **kwargs) -> Dict[str, List[str]]:
+    """Downloads the provinces data and updates the locations file.
+
+    Args:
+        dry_run (bool, optional): if True, the file is not written.
+            Defaults to False.
+        **kwargs: keyword arguments passed to `fetch_provinces`.
+
+    Returns:
+        Dict[str, List[str]]: differences with the previous file, as returned
+            by `diff_provinces`.
+    """
+
+    new = fetch_provinces(**kwargs)
+    diff = diff_provinces(json.loads(json_path.read_text("utf8")), new)
+
+    if not dry_run and any(diff.values()):
+        write_atomic(json_path, json.dumps(new, indent=4))
+        get_provinces.cache_clear()
+        get_city_index.cache_clear()
+        get_city_search_index.cache_clear()
+    return diff
@@ -0,0 +1,31 @@
+import argparse
+
+from . import json_path, regenerate_provinces
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m dominos.locations",
+        description="Regenerates the provinces and cities ids file.",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="don't write the file")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent provinces")
+    parser.add_argument("--max-requests", type=int, help="max in-flight requests")
+    args = parser.parse_args()
+
+    diff = regenerate_provinces(
+        dry_run=args.dry_run, max_workers=args.workers, max_requests=args.max_requests
+    )
+
+    for kind, cities in diff.items():
+        for city in cities:
+            print(f"{kind}: {city}")
+
+    if not any(diff.values()):
+        print(f"{json_path.name} is up to date")
+    elif not args.dry_run:
+        print(f"{json_path.name} updated")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Fuzzy and accent-insensitive search of cities, using a trigram index."""
+
+from collections import defaultdict
+from difflib import SequenceMatcher
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from dominos.utils import remove_accents
+
+_ARTICLE_PATTERN = re.compile(r"(.+?)\s*\((\w+)\)")
+
+
+class CityCandidate(NamedTuple):
+    province: str
+    city: str
+    province_id: int
+    city_id: str
+    score: float
+
+
+def normalize_name(name: str) -> str:
+    return remove_accents(name).strip().lower()
+
+
+def trigrams(name: str) -> Set[str]:
+    padded = f"  {name} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def name_variants(name: str) -> List[str]:
+    """Returns the normalized names a city can be written as.
+
+    Bilingual names ("ALCOY/ALCOI") are split, and trailing articles are
+    moved to the front ("ROZAS DE MADRID (LAS)" -> "las rozas de madrid").
+    """
+
+    name = normalize_name(name)
+    variants = [name]
+    for part in name.split("/"):
+        part = part.strip()
+        match = _ARTICLE_PATTERN.fullmatch(part)
+        if match:
+            part = f"{match.group(2)} {match.group(1)}"
+        if part not in variants:
+            variants.append(part)
+    return variants
+
+
+class CityIndex:
+    """Trigram index of the cities of every province.
+
+    Trigrams select the candidates and the edit similarity ranks them.
+
+    Args:
+        provinces (Dict[str, Any]): provinces and their cities, as returned by
+            `dominos.locations.get_provinces`.
+    """
+
+    preselected = 10
+
+    def __init__(self, provinces: Dict[str, Any]):
+        self.cities: List[CityCandidate] = []
+        self.names: List[Tuple[str, int, int]] = []
+        self.trigrams: Dict[str, List[int]] = defaultdict(list)
+        self.provinces: Dict[str, Set[int]] = defaultdict(set)
+
+        for province_name, province_data in provinces.items():
+            for city_name, city_id in province_data["cities"].items():
+                city_position = len(self.cities)
+                self.cities.append(
+                    CityCandidate(
+                        province_name, city_name, province_data["id"], city_id, 0
+                    )
+                )
+                self.provinces[normalize_name(province_name)].add(city_position)
+
+                for name in name_variants(city_name):
+                    name_trigrams = trigrams(name)
+                    for trigram in name_trigrams:
+                        self.trigrams[trigram].append(len(self.names))
+                    self.names.append((name, len(name_trigrams), city_position))
+
+    def search(
+        self, city: str, province: Optional[str] = None, limit=5, min_score=0.0
+    ) -> List[CityCandidate]:
+        """Finds the cities most similar to a name.
+
+        Args:
+            city (str): name of the city, with or without accents.
+            province (str, optional): name of the province. If it's a known
+                province, only its cities are searched. Defaults to None.
+            limit (int, optional): maximum number of candidates. Defaults to 5.
+            min_score (float, optional): minimum edit similarity of the
+                candidates, from 0 to 1. Defaults to 0.
+
+        Returns:
+            List[CityCandidate]: candidates, best first.
+        """
+
+        name = normalize_name(city)
+        name_trigrams = trigrams(name)
+
+        allowed = None
+        if province is not None:
+            allowed = self.provinces.get(normalize_name(province))
+
+        shared = defaultdict(int)
+        for trigram in name_trigrams:
+            for position in self.trigrams.get(trigram, ()):
+                shared[position] += 1
+
+        def similarity(position):
+            n_trigrams = self.names[position][1]
+            n_shared = shared[position]
+            return n_shared / (len(name_trigrams) + n_trigrams - n_shared)
+
+        positions = [
+            x for x in shared if allowed is None or self.names[x][2] in allowed
+        ]
+        positions.sort(key=similarity, reverse=True)
+
+        scores: Dict[int, float] = {}
+        for position in positions[: max(limit, self.preselected)]:
+            candidate_name, _, city_position = self.names[position]
+            score = SequenceMatcher(None, name, candidate_name).ratio()
+            if score >= min_score and score > scores.get(city_position, -1):
+                scores[city_position] = score
+
+        candidates = [self.cities[x]._replace(score=y) for x, y in scores.items()]
+        candidates.sort(key=lambda x: x.score, reverse=True)
+        return candidates[:limit]
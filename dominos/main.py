@@ -1,27 +1,43 @@
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
+from functools import partial
 from pathlib import Path
-from typing import List, Optional
-from urllib.parse import urljoin
-
-from bs4 import BeautifulSoup
-from dateutil.parser import parse
-from unidecode import unidecode
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Union
 
+from . import metrics, profiling
+from .cache import Journal, ResultCache, ShopCache, SQLiteStore
 from .codes import get_codes
+from .exceptions import CircuitOpenError, SessionExpiredError, StoppedError
 from .locations import OrderType, Shop, get_shop_by_address
-from .networking import Downloader
+from .networking import Downloader, RequestLimiter, get_open_breakers, get_url
+from .parsing import PromotionTracker, parse_token
+from .scheduler import Budget, CodeScheduler
 from .schemas import Address, AppliedPromotion, Information, WorkingCode
-from .utils import BASE_URL
+
+logger = logging.getLogger(__name__)
+
+MAX_SESSION_RENEWALS = 3
+
+ProgressCallback = Callable[[Address, Union[Information, Exception], int, int], None]
 
 
 class Dominos:
-    def __init__(self):
-        self.downloader = Downloader()
+    def __init__(self, limiter: Optional[RequestLimiter] = None):
+        self.downloader = Downloader(limiter=limiter)
         self.shop: Optional[Shop] = None
         self.order_type: Optional[OrderType] = None
-        self.applied_promotions: List[AppliedPromotion] = []
+        self.promotions = PromotionTracker()
         self._token = None
 
+    @property
+    def applied_promotions(self) -> List[AppliedPromotion]:
+        return self.promotions.promotions
+
     @property
     def token(self) -> str:
         if not self._token:
@@ -29,16 +45,11 @@ class Dominos:
         return self._token
 
     def get_token(self) -> str:
-        url = urljoin(BASE_URL, "promociones")
-        res = self.downloader.get(url)
-        soup = BeautifulSoup(res.text, "html.parser")
-
-        token_container = soup.find("form", id="__AjaxAntiForgeryForm")
-        if token_container is None:
-            raise ValueError("Can't get AjaxAntiForgeryForm token")
-
-        token = token_container.input["value"]
-        return token
+        with metrics.timed("dominos_phase_seconds", phase="get_token"):
+            url = get_url("promociones")
+            res = self.downloader.get(url)
+            with metrics.timed("dominos_parse_seconds", parser="token"):
+                return parse_token(res.text)
 
     def select_shop(self, province, city, street_name, street_number):
         address = Address(
@@ -57,18 +68,36 @@ class Dominos:
         if not self.shop or not self.order_type:
             raise ValueError("Shop or order type not configured")
 
+        with metrics.timed("dominos_phase_seconds", phase="start_order"):
+            self._start_order()
+
+    def _start_order(self):
         payload = {
             "idTienda": self.shop.id,
             "tipoPedido": self.order_type.value.title(),
         }
 
-        url = urljoin(BASE_URL, "Pedido/IniciarPedidoSession")
+        url = get_url("Pedido/IniciarPedidoSession")
         response = self.downloader.post(url, data=payload)
         response.raise_for_status()
         assert response.json()["result"] is True
 
-    def check_code(self, code):
-        url = urljoin(BASE_URL, "Promocion/AplicarCodPromo")
+    def check_code(self, code) -> Optional[WorkingCode]:
+        return self.apply_code(code)[1]
+
+    def apply_code(self, code) -> Tuple[bool, Optional[WorkingCode]]:
+        """Applies a code to the order.
+
+        Returns:
+            Tuple[bool, Optional[WorkingCode]]: whether the server accepted the
+                code, and the code if it gave a promotion not found before.
+        """
+
+        with metrics.timed("dominos_phase_seconds", phase="check_code"):
+            return self._check_code(code)
+
+    def _check_code(self, code):
+        url = get_url("Promocion/AplicarCodPromo")
         payload = {
             "CodPromo": code,
             "url": False,
@@ -78,40 +107,482 @@ class Dominos:
         response = self.downloader.post(url, data=payload)
         response.raise_for_status()
 
-        if not response.json()["result"]:
+        # An expired session or token is answered with an HTML error page.
+        if response.headers.get("content-type", "").split(";")[0] != "application/json":
+            raise SessionExpiredError(code, response.status_code)
+
+        data = response.json()
+        if not data["result"]:
+            return False, None
+
+        with metrics.timed("dominos_parse_seconds", parser="promotions"):
+            new_promotions = self.promotions.update_from_response(data, self.order_type)
+        if new_promotions is None:
+            url = get_url("promociones")
+            response = self.downloader.get(url)
+            with metrics.timed("dominos_parse_seconds", parser="promotions"):
+                new_promotions = self.promotions.update(response.text, self.order_type)
+
+        if new_promotions:
+            return True, WorkingCode(code=code, **new_promotions[0].dict())
+        return True, None
+
+    def check_all_codes(
+        self,
+        cache: Optional[ResultCache] = None,
+        scheduler: Optional[CodeScheduler] = None,
+        budget: Optional[Budget] = None,
+        journal: Optional[Journal] = None,
+        checked_codes: Optional[Dict[str, Optional[WorkingCode]]] = None,
+        stop: Optional[threading.Event] = None,
+    ):
+        """Checks the codes in the shop and order type of the session.
+
+        Args:
+            cache (ResultCache, optional): cache used to skip the codes that
+                failed recently. Defaults to None.
+            scheduler (CodeScheduler, optional): sorts the codes by their
+                chances of working. Defaults to None.
+            budget (Budget, optional): limit of codes checked or time spent.
+                Defaults to None.
+            journal (Journal, optional): journal where the outcome of each
+                code is saved. Defaults to None.
+            checked_codes (Dict[str, Optional[WorkingCode]], optional): codes
+                already checked by another session, with their working code
+                or None. They're skipped and the outcome of each code checked
+                is added. Defaults to None.
+            stop (threading.Event, optional): if set, no more codes are
+                checked. Defaults to None.
+
+        Yields:
+            WorkingCode: codes that work, except the ones in `checked_codes`.
+
+        Raises:
+            SessionExpiredError: if the session expired. The code that raised
+                it is not added to `checked_codes`.
+            StoppedError: if `stop` was set before checking every code.
+        """
+
+        codes = get_codes()
+        if checked_codes:
+            # The promotions found by the other session are not applied to
+            # this order, so the codes giving them again aren't new.
+            for working_code in checked_codes.values():
+                if working_code:
+                    promotion = working_code.dict(exclude={"code"})
+                    self.promotions.add(AppliedPromotion(**promotion))
+            codes = [code for code in codes if code not in checked_codes]
+
+        full_check = True
+        if cache:
+            cache.record_shop(self.shop)
+            full_check = cache.needs_full_check(self.shop.id, self.order_type)
+            if not full_check:
+                codes = cache.filter_codes(codes, self.shop.id, self.order_type)
+
+        if scheduler:
+            codes = scheduler.order(codes, self.shop, self.order_type)
+
+        checked = 0
+        for code in budget.limit(codes) if budget else codes:
+            if stop and stop.is_set():
+                raise StoppedError(code)
+            checked += 1
+            accepted, working_code = self.apply_code(code)
+            if cache:
+                # A code giving a promotion already found still works.
+                cache.record(code, self.shop.id, self.order_type, accepted)
+            if journal:
+                journal.record_code(code, self.shop.id, self.order_type, working_code)
+            if checked_codes is not None:
+                checked_codes[code] = working_code
+            if working_code:
+                yield working_code
+
+        if cache and full_check and checked == len(codes):
+            cache.record_sweep(self.shop.id, self.order_type)
+
+
+class SessionPool:
+    """Keeps pre-warmed order sessions for each shop and order type.
+
+    A warm session is a `Dominos` instance that already has its anti-forgery
+    token and a started order, so codes can be checked right away. Sessions
+    are warmed in background threads and discarded when they are older than
+    `max_age` or a checker reports them as expired.
+
+    Args:
+        size (int, optional): number of warm sessions kept for each shop and
+            order type. Defaults to 1.
+        max_age (int, optional): seconds a warm session is considered valid.
+            Defaults to 600.
+        workers (int, optional): number of background threads used to warm
+            sessions. Defaults to 2.
+        limiter (RequestLimiter, optional): limiter shared by all the
+            sessions of the pool. Defaults to None.
+    """
+
+    def __init__(self, size=1, max_age=600, workers=2, limiter=None):
+        self.size = size
+        self.max_age = max_age
+        self.limiter = limiter
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="dominos-warm"
+        )
+        self._condition = threading.Condition()
+        self._ready: Dict[Tuple[int, OrderType], Deque] = defaultdict(deque)
+        self._pending: Dict[Tuple[int, OrderType], int] = defaultdict(int)
+        self._leased: Dict[int, float] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def warm(self, shop: Shop, order_type: OrderType) -> Dominos:
+        """Creates a new session with its token and order already started."""
+
+        dominos = Dominos(limiter=self.limiter)
+        dominos.shop = shop
+        dominos.order_type = order_type
+        dominos.token  # pylint: disable=pointless-statement
+        dominos.start_order()
+        return dominos
+
+    def prewarm(self, shop: Shop, order_type: OrderType, n: Optional[int] = None):
+        """Warms in background the sessions missing to have `n` ready.
+
+        Args:
+            shop (Shop): shop of the sessions.
+            order_type (OrderType): order type of the sessions.
+            n (int, optional): number of sessions wanted. If none, it's set
+                to `SessionPool.size`. Defaults to None.
+        """
+
+        key = (shop.id, order_type)
+        n = self.size if n is None else n
+
+        with self._condition:
+            missing = n - len(self._ready[key]) - self._pending[key]
+            self._pending[key] += max(0, missing)
+
+        for _ in range(missing):
+            future = self._executor.submit(self._timed_warm, shop, order_type)
+            future.add_done_callback(lambda f, key=key: self._on_warmed(key, f))
+
+    def acquire(self, shop: Shop, order_type: OrderType, timeout=None) -> Dominos:
+        """Hands out a warm session, warming one now if none is on its way.
+
+        Args:
+            shop (Shop): shop of the session.
+            order_type (OrderType): order type of the session.
+            timeout (float, optional): seconds to wait for a session being
+                warmed in background. Defaults to None.
+
+        Returns:
+            Dominos: warm session. It must be given back with `release`.
+        """
+
+        key = (shop.id, order_type)
+
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._ready[key] or not self._pending[key], timeout
+            )
+            entry = self._pop_ready(key)
+
+        warmed_at, dominos = entry or self._timed_warm(shop, order_type)
+        with self._condition:
+            self._leased[id(dominos)] = warmed_at
+        return dominos
+
+    def release(self, dominos: Dominos, discard=False, expired=False):
+        """Reclaims a session handed out by `acquire`.
+
+        Args:
+            dominos (Dominos): session to reclaim.
+            discard (bool, optional): if True, the session is not reused
+                because its order is no longer clean. Defaults to False.
+            expired (bool, optional): if True, the session is not reused
+                and a new one is warmed in background. Reclaimed sessions
+                older than `max_age` are also replaced. Defaults to False.
+        """
+
+        with self._condition:
+            warmed_at = self._leased.pop(id(dominos))
+        if discard and not expired:
+            return
+        if expired or self._is_expired(warmed_at):
+            self.prewarm(dominos.shop, dominos.order_type)
             return
 
-        url = urljoin(BASE_URL, "promociones")
-        response = self.downloader.get(url)
-        soup = BeautifulSoup(response.text, "html.parser")
-        promotions_container = list(soup.find_all("div", class_="promo-content"))
-
-        if not promotions_container:
-            raise ValueError("Can't get promotions container")
-
-        for promotion in promotions_container:
-            description = promotion.find("h3").text.strip()
-            expires_container = promotion.find("div", class_="promo-description")
-            expires_text = unidecode(expires_container.text).strip(" .")
-            expires = expires_text.split()[-1].strip(". ")
-            expires = parse(expires).date()
-            promotion = AppliedPromotion(
-                order_type=self.order_type, description=description, expires=expires
+        key = (dominos.shop.id, dominos.order_type)
+        with self._condition:
+            self._ready[key].append((warmed_at, dominos))
+            self._condition.notify_all()
+
+    @contextmanager
+    def session(self, shop: Shop, order_type: OrderType):
+        """Context manager version of `acquire` and `release`."""
+
+        dominos = self.acquire(shop, order_type)
+        try:
+            yield dominos
+        except SessionExpiredError:
+            self.release(dominos, expired=True)
+            raise
+        except BaseException:
+            self.release(dominos)
+            raise
+        else:
+            self.release(dominos)
+
+    def _timed_warm(self, shop: Shop, order_type: OrderType):
+        return time.monotonic(), self.warm(shop, order_type)
+
+    def _on_warmed(self, key, future):
+        with self._condition:
+            self._pending[key] -= 1
+            if not future.cancelled():
+                exc = future.exception()
+                if exc is None:
+                    self._ready[key].append(future.result())
+                else:
+                    logger.warning("Error warming session %s: %r", key, exc)
+            self._condition.notify_all()
+
+    def _pop_ready(self, key):
+        ready = self._ready[key]
+        while ready:
+            entry = ready.popleft()
+            if not self._is_expired(entry[0]):
+                return entry
+        return None
+
+    def _is_expired(self, warmed_at: float) -> bool:
+        return time.monotonic() - warmed_at > self.max_age
+
+
+def check_order_type(
+    pool: SessionPool,
+    shop: Shop,
+    order_type: OrderType,
+    cache: Optional[ResultCache] = None,
+    scheduler: Optional[CodeScheduler] = None,
+    budget: Optional[Budget] = None,
+    journal: Optional[Journal] = None,
+    stop: Optional[threading.Event] = None,
+) -> List[WorkingCode]:
+    """Checks all the codes in a shop and order type with sessions of a pool.
+
+    When a session expires, a new one is warmed in background and the codes
+    not checked yet are checked with it, up to `MAX_SESSION_RENEWALS` times.
+    The codes checked in a previous run saved in the journal are skipped.
+
+    Returns:
+        List[WorkingCode]: working codes.
+
+    Raises:
+        SessionExpiredError: if too many sessions expired.
+        StoppedError: if `stop` was set before checking every code.
+    """
+
+    checked_codes = journal.get_codes(shop.id, order_type) if journal else {}
+    codes = [x for x in checked_codes.values() if x]
+    previously_checked = len(checked_codes)
+    start = time.monotonic()
+
+    dominos = pool.acquire(shop, order_type)
+    renewals = 0
+    try:
+        while True:
+            try:
+                for code in dominos.check_all_codes(
+                    cache, scheduler, budget, journal, checked_codes, stop
+                ):
+                    codes.append(code)
+                return codes
+            except SessionExpiredError as exc:
+                pool.release(dominos, expired=True)
+                dominos = None
+                renewals += 1
+                if renewals > MAX_SESSION_RENEWALS:
+                    raise
+                logger.warning(
+                    "Session of %s (%s) expired checking %s, renewing it",
+                    shop.name_alias,
+                    order_type.value,
+                    exc.args[0],
+                )
+                dominos = pool.acquire(shop, order_type)
+                if budget:
+                    # The budget covers the whole sweep, not each session.
+                    budget = budget.remaining(
+                        len(checked_codes) - previously_checked,
+                        time.monotonic() - start,
+                    )
+                    previously_checked = len(checked_codes)
+                    start = time.monotonic()
+    finally:
+        if dominos:
+            # Its order has the working codes applied, so it can't be reused.
+            pool.release(dominos, discard=True)
+
+
+def update_shop(
+    address: Address,
+    base_folder: Path,
+    limiter: Optional[RequestLimiter] = None,
+    pool: Optional[SessionPool] = None,
+    cache: Optional[ResultCache] = None,
+    scheduler: Optional[CodeScheduler] = None,
+    budget: Optional[Budget] = None,
+    strict=True,
+    shop_cache: Optional[ShopCache] = None,
+    profile=False,
+    journal: Optional[Journal] = None,
+    stop: Optional[threading.Event] = None,
+) -> Information:
+    if journal:
+        info = journal.get_shop(address)
+        if info:
+            return info
+
+    if pool is None:
+        with SessionPool(limiter=limiter) as pool:
+            return update_shop(
+                address,
+                base_folder,
+                limiter=limiter,
+                pool=pool,
+                cache=cache,
+                scheduler=scheduler,
+                budget=budget,
+                strict=strict,
+                shop_cache=shop_cache,
+                profile=profile,
+                journal=journal,
+                stop=stop,
             )
 
-            if promotion not in self.applied_promotions:
-                self.applied_promotions.append(promotion)
-                return WorkingCode(code=code, **promotion.dict())
+    # The shop lookup uses the shared location downloader, so it's capped here.
+    with limiter or nullcontext(), metrics.timed(
+        "dominos_phase_seconds", phase="get_shop_by_address"
+    ):
+        if shop_cache:
+            shop = shop_cache.get_shop(address, strict=strict)
+        else:
+            shop = get_shop_by_address(address, strict=strict)
+    file_path = base_folder / f"{shop.name_alias}.txt"
 
-    def check_all_codes(self):
-        codes = get_codes()
-        for code in codes:
-            code = self.check_code(code)
-            if code:
-                yield code
+    order_types = dict()
+    if journal:
+        for order_type in OrderType:
+            codes = journal.get_order_type(shop.id, order_type)
+            if codes is not None:
+                order_types[order_type.value] = codes
 
+    for order_type in OrderType:
+        if order_type.value not in order_types:
+            pool.prewarm(shop, order_type)
+
+    for order_type in OrderType:
+        if order_type.value in order_types:
+            continue
+
+        if profile:
+            prefix = base_folder / f"{shop.name_alias}.{order_type.value}"
+            profiler = profiling.profile(prefix)
+        else:
+            profiler = nullcontext()
+
+        with profiler:
+            codes = check_order_type(
+                pool, shop, order_type, cache, scheduler, budget, journal, stop
+            )
+        order_types[order_type.value] = codes
+        if journal:
+            journal.record_order_type(shop.id, order_type, codes)
+
+    info = Information(shop=shop, updated=datetime.now(), order_types=order_types)
+
+    with metrics.timed("dominos_phase_seconds", phase="write_json"):
+        data = info.json(ensure_ascii=False, indent=4)
+        file_path.write_text(data, "utf8")
+    if journal:
+        journal.record_shop(address, info)
+    return info
+
+
+def update_codes(
+    addresses: List[Address],
+    base_folder="",
+    max_workers=1,
+    max_requests: Optional[int] = None,
+    progress: Optional[ProgressCallback] = None,
+    cache: Union[bool, ResultCache] = False,
+    prioritize=False,
+    budget: Optional[Budget] = None,
+    strict=True,
+    shop_cache: Union[bool, ShopCache] = False,
+    deferrals=1,
+    profile=False,
+    journal: Union[bool, Journal] = False,
+) -> List[Information]:
+    """Checks all the codes in the shops closest to each address.
+
+    Args:
+        addresses (List[Address]): addresses of the shops to update.
+        base_folder (str, optional): folder where the shops information is
+            saved. Defaults to the repository root.
+        max_workers (int, optional): number of shops updated concurrently.
+            Defaults to 1.
+        max_requests (int, optional): maximum number of in-flight requests
+            shared by all the workers. If none, it's set to max_workers.
+            Defaults to None.
+        progress (ProgressCallback, optional): called after each shop is
+            processed with the address, its Information (or the exception
+            raised), the number of shops processed and the total number
+            of shops. Defaults to None.
+        cache (Union[bool, ResultCache], optional): cache used to skip the
+            codes that failed recently. If True, a cache with the default
+            settings is stored in the base folder. Defaults to False.
+        prioritize (bool, optional): if True, codes are checked in order of
+            their chances of working, computed from the statistics of the
+            cache. Defaults to False.
+        budget (Budget, optional): limit of codes checked or time spent in
+            each shop and order type. Defaults to None.
+        strict (bool, optional): if False, misspelled cities are resolved to
+            the most similar known city. Defaults to True.
+        shop_cache (Union[bool, ShopCache], optional): cache of the shop
+            closest to each address. If True, a cache with the default
+            settings is stored in the base folder. Defaults to False.
+        deferrals (int, optional): number of times a shop is retried after
+            failing because a circuit breaker was open. Deferred shops are
+            retried once every other shop is processed and the breakers let
+            requests through again. Defaults to 1.
+        profile (bool, optional): if True, the code checks of each shop and
+            order type are profiled. CPU time (`.pstats`) and sampled wall
+            time stacks (`.collapsed`) are saved next to the shop file, see
+            `dominos.profiling`. Sessions warmed in background threads are
+            not profiled. Defaults to False.
+        journal (Union[bool, Journal], optional): journal of the progress.
+            Finished shops, finished order types and checked codes are saved
+            in it, so running again after an interruption skips them. It's
+            cleared when the run ends, even if some shops failed or were
+            skipped, so they're updated from scratch next time. If True, a
+            journal with the default settings is stored in the base folder.
+            Defaults to False.
+
+    Returns:
+        List[Information]: information of the updated shops, in the same
+            order as the addresses. Shops that failed are logged and skipped.
+    """
 
-def update_codes(addresses: List[Address], base_folder=""):
     if base_folder:
         base_folder = Path(base_folder).absolute()
     else:
@@ -119,24 +590,136 @@ def update_codes(addresses: List[Address], base_folder=""):
 
     base_folder.mkdir(exist_ok=True, parents=True)
 
-    for address in addresses:
-        dominos = Dominos()
-        dominos.select_shop(**address.dict())
-        file_path = base_folder / f"{dominos.shop.name_alias}.txt"
+    if prioritize and not cache:
+        raise ValueError("Codes can't be prioritized without cache")
 
-        order_types = dict()
+    # The stores opened here are closed when done.
+    opened: List[SQLiteStore] = []
+    if cache is True:
+        cache = ResultCache.in_folder(base_folder)
+        opened.append(cache)
+    if shop_cache is True:
+        shop_cache = ShopCache.in_folder(base_folder)
+        opened.append(shop_cache)
+    if journal is True:
+        journal = Journal.in_folder(base_folder)
+        opened.append(journal)
 
-        for order_type in OrderType:
-            dominos.select_type(order_type.name)
-            dominos.start_order()
-            codes = []
-            for code in dominos.check_all_codes():
-                codes.append(code)
-            order_types[order_type.value] = codes
-
-        info = Information(
-            shop=dominos.shop, updated=datetime.now(), order_types=order_types
+    try:
+        return _update_codes(
+            addresses,
+            base_folder,
+            max_workers=max_workers,
+            max_requests=max_requests,
+            progress=progress,
+            cache=cache or None,
+            scheduler=CodeScheduler(cache) if prioritize else None,
+            budget=budget,
+            strict=strict,
+            shop_cache=shop_cache or None,
+            deferrals=deferrals,
+            profile=profile,
+            journal=journal or None,
         )
+    finally:
+        for store in opened:
+            store.close()
 
-        data = info.json(ensure_ascii=False, indent=4)
-        file_path.write_text(data, "utf8")
+
+def _update_codes(
+    addresses: List[Address],
+    base_folder: Path,
+    max_workers: int,
+    max_requests: Optional[int],
+    progress: Optional[ProgressCallback],
+    cache: Optional[ResultCache],
+    scheduler: Optional[CodeScheduler],
+    budget: Optional[Budget],
+    strict: bool,
+    shop_cache: Optional[ShopCache],
+    deferrals: int,
+    profile: bool,
+    journal: Optional[Journal],
+) -> List[Information]:
+    limiter = RequestLimiter(max_requests or max_workers)
+    results = {}
+    total = len(addresses)
+
+    pool = SessionPool(workers=2 * max_workers, limiter=limiter)
+
+    update = partial(
+        update_shop,
+        base_folder=base_folder,
+        limiter=limiter,
+        pool=pool,
+        cache=cache,
+        scheduler=scheduler,
+        budget=budget,
+        strict=strict,
+        shop_cache=shop_cache,
+        profile=profile,
+        journal=journal,
+    )
+
+    pending = list(range(total))
+    done = 0
+
+    with pool, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for attempt in range(deferrals + 1):
+            if attempt:
+                wait = max((x.retry_in() for x in get_open_breakers()), default=0)
+                logger.info(
+                    "Retrying %d deferred shops in %.1f seconds", len(pending), wait
+                )
+                time.sleep(wait)
+                # Half-open breakers let a single probe through, so the first
+                # shop goes alone and the rest follow if it closed them.
+                batches = [pending[:1], pending[1:]]
+            else:
+                batches = [pending]
+
+            deferred = []
+            for batch in batches:
+                if deferred:
+                    # The probe failed, so the breakers are open again.
+                    deferred.extend(batch)
+                    continue
+
+                futures = {executor.submit(update, addresses[x]): x for x in batch}
+
+                for future in as_completed(futures):
+                    index = futures[future]
+                    address = addresses[index]
+                    try:
+                        result = future.result()
+                    except CircuitOpenError as exc:
+                        if attempt < deferrals:
+                            logger.warning("Deferred shop of %s: %s", address, exc)
+                            deferred.append(index)
+                            continue
+                        logger.error("Skipped shop of %s: %s", address, exc)
+                        result = exc
+                    except Exception as exc:  # pylint: disable=broad-except
+                        logger.exception("Error updating shop of %s", address)
+                        result = exc
+                    else:
+                        results[index] = result
+
+                    done += 1
+                    if not isinstance(result, Exception):
+                        logger.info(
+                            "Updated %s (%d/%d)", result.shop.name_alias, done, total
+                        )
+                    if progress:
+                        progress(address, result, done, total)
+
+            pending = deferred
+            if not pending:
+                break
+
+    # Only interrupted runs resume, failed shops are retried from scratch.
+    if journal:
+        journal.clear()
+
+    metrics.flush()
+    return [results[index] for index in sorted(results)]
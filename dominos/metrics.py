@@ -0,0 +1,239 @@
+"""Timing and traffic metrics, exported through pluggable sinks.
+
+Metrics are only recorded while there are sinks configured, so the
+instrumentation costs almost nothing when it's disabled (the default)::
+
+    from dominos import metrics
+
+    sink = metrics.MemorySink()
+    metrics.configure(sink, metrics.PrometheusFileSink("metrics.prom"))
+    update_codes(addresses)
+    print(sink.registry.histograms)
+"""
+
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+from .utils import write_atomic
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, like Prometheus ones.
+
+    Args:
+        buckets (Tuple[float, ...], optional): upper bounds of the buckets.
+            Defaults to DEFAULT_BUCKETS.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[int]:
+        counts, total = [], 0
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+    def quantile(self, q: float) -> float:
+        """Returns the upper bound of the bucket of the q-quantile."""
+
+        target = q * self.count
+        for bound, count in zip(self.buckets, self.cumulative_counts()):
+            if count >= target:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    """Thread-safe collection of counters and histograms, by name and labels."""
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float, labels: Labels):
+        with self._lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: Labels):
+        with self._lock:
+            key = (name, labels)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def to_prometheus(self) -> str:
+        """Renders the metrics in the Prometheus text format."""
+
+        lines = []
+        with self._lock:
+            for name in sorted({x for x, _ in self.counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (key, labels), value in sorted(self.counters.items()):
+                    if key == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+            for name in sorted({x for x, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (key, labels), histogram in sorted(
+                    self.histograms.items(), key=lambda x: x[0]
+                ):
+                    if key != name:
+                        continue
+                    bounds = [f"{x:g}" for x in histogram.buckets] + ["+Inf"]
+                    for bound, count in zip(bounds, histogram.cumulative_counts()):
+                        bucket_labels = labels + (("le", bound),)
+                        lines.append(
+                            f"{name}_bucket{_format_labels(bucket_labels)} {count}"
+                        )
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(
+                        f"{name}_count{_format_labels(labels)} {histogram.count}"
+                    )
+
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = ((x, str(y).replace("\\", "\\\\").replace('"', '\\"')) for x, y in labels)
+    return "{" + ",".join(f'{x}="{y}"' for x, y in escaped) + "}"
+
+
+class MemorySink:
+    """Keeps the metrics in memory, in `registry`."""
+
+    def __init__(self):
+        self.registry = MetricsRegistry()
+
+    def increment(self, name: str, value: float, labels: Labels):
+        self.registry.increment(name, value, labels)
+
+    def observe(self, name: str, value: float, labels: Labels):
+        self.registry.observe(name, value, labels)
+
+    def flush(self):
+        pass
+
+
+class PrometheusFileSink(MemorySink):
+    """Writes the metrics to a file in the Prometheus text format on `flush`.
+
+    The file can be read by the textfile collector of node_exporter.
+
+    Args:
+        path (Union[str, Path]): path of the file.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        super().__init__()
+        self.path = Path(path)
+
+    def flush(self):
+        write_atomic(self.path, self.registry.to_prometheus())
+
+
+class LogSink:
+    """Logs each measure as a json object.
+
+    Args:
+        level (int, optional): level of the logs. Defaults to logging.DEBUG.
+    """
+
+    def __init__(self, level=logging.DEBUG):
+        self.level = level
+
+    def increment(self, name: str, value: float, labels: Labels):
+        self._log("counter", name, value, labels)
+
+    def observe(self, name: str, value: float, labels: Labels):
+        self._log("histogram", name, value, labels)
+
+    def _log(self, kind: str, name: str, value: float, labels: Labels):
+        if logger.isEnabledFor(self.level):
+            data = {"metric": name, "type": kind, "value": value, **dict(labels)}
+            logger.log(self.level, json.dumps(data))
+
+    def flush(self):
+        pass
+
+
+_sinks: Tuple = ()
+_disabled = nullcontext()
+
+
+def configure(*sinks):
+    """Sets the sinks of the metrics. Without sinks, metrics are disabled."""
+
+    global _sinks  # pylint: disable=global-statement
+    _sinks = tuple(sinks)
+
+
+def enabled() -> bool:
+    return bool(_sinks)
+
+
+def increment(name: str, value: float = 1, **labels):
+    """Adds a value to a counter."""
+
+    if _sinks:
+        labels = tuple(sorted(labels.items()))
+        for sink in _sinks:
+            sink.increment(name, value, labels)
+
+
+def observe(name: str, value: float, **labels):
+    """Records a value in a histogram."""
+
+    if _sinks:
+        labels = tuple(sorted(labels.items()))
+        for sink in _sinks:
+            sink.observe(name, value, labels)
+
+
+@contextmanager
+def _timer(name: str, labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed(name: str, **labels):
+    """Context manager that records the seconds spent in a block."""
+
+    if not _sinks:
+        return _disabled
+    return _timer(name, labels)
+
+
+def flush():
+    """Exports the metrics of the sinks that write them somewhere."""
+
+    for sink in _sinks:
+        sink.flush()
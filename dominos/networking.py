@@ -1,10 +1,25 @@
 """Custom downloader with retries control."""
 
+import asyncio
 import logging
+import random
+import socket
+import threading
+import time
+import weakref
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import urljoin, urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
-from .exceptions import DownloaderError
+from . import metrics
+from .exceptions import CircuitOpenError, DownloaderError
 from .utils import BASE_URL, MetaSingleton
 
 logger = logging.getLogger(__name__)
@@ -13,14 +28,658 @@ NEW_HEADERS = {"User-Agent": "AutoDominos/2.0", "Referer": BASE_URL}
 
 
 class _settings:
+    base_url = BASE_URL
     retries = 5
     timeout = 30
+    # Shared by every downloader of the process, see `get_throttle`.
+    rate_limit: Optional[float] = None
+    burst = 1
+    max_connections_per_host: Optional[int] = None
+    # Used by the default retry policy, see `get_retry_policy`.
+    backoff_factor = 0.5
+    max_backoff = 30
+    retry_statuses = (429, 500, 502, 503, 504)
+    retry_budget_ratio = 0.2
+    retry_budget_min = 10
+    # Endpoints guarded by a circuit breaker, see `get_breaker`.
+    breaker_endpoints = (
+        "AplicarCodPromo",
+        "promociones",
+        "BuscarTiendas",
+        "IniciarPedidoSession",
+    )
+    breaker_failure_threshold = 5
+    breaker_recovery_timeout = 30
+    # Connection pooling of each downloader, see `PooledAdapter`.
+    pool_connections = 10
+    pool_maxsize = 10
+    pool_block = False
+    keep_alive = True
+    tcp_keepalive = True
+    # Records or replays the requests, see `dominos.cassette.Cassette`.
+    cassette = None
 
 
 settings = _settings()
 del _settings
 
 
+def get_url(path: str) -> str:
+    """Returns the url of a path of the site, see `settings.base_url`."""
+
+    return urljoin(settings.base_url, path)
+
+
+class RequestLimiter:
+    """Caps the number of in-flight requests shared by several downloaders.
+
+    Args:
+        max_requests (int): maximum number of concurrent requests.
+    """
+
+    def __init__(self, max_requests: int):
+        self.max_requests = max_requests
+        self._semaphore = threading.BoundedSemaphore(max_requests)
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self._semaphore.release()
+
+
+class Throttle:
+    """Token bucket rate limiter with a concurrency cap for each host.
+
+    It works both with threads and asyncio tasks: tokens are reserved under a
+    lock and the caller sleeps (or awaits) until its reservation is due.
+
+    Args:
+        rate (float, optional): requests per second. If none, requests are
+            not rate limited. Defaults to None.
+        burst (int, optional): maximum number of requests made at once after
+            being idle. Defaults to 1.
+        max_per_host (int, optional): maximum number of concurrent requests
+            to the same host. Defaults to None.
+    """
+
+    def __init__(self, rate: Optional[float] = None, burst=1, max_per_host=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_per_host = max_per_host
+
+        self.requests = 0
+        self.waited = 0.0
+        self.max_wait = 0.0
+
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._host_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._async_host_semaphores = weakref.WeakKeyDictionary()
+
+    def reserve(self) -> float:
+        """Takes a token and returns the seconds to wait before using it."""
+
+        with self._lock:
+            self.requests += 1
+            if not self.rate:
+                return 0.0
+
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._updated = now
+            self._tokens -= 1
+
+            wait = max(0.0, -self._tokens / self.rate)
+            self.waited += wait
+            self.max_wait = max(self.max_wait, wait)
+            return wait
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the number of requests and the seconds spent waiting."""
+
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "waited": self.waited,
+                "max_wait": self.max_wait,
+            }
+
+    @contextmanager
+    def limit(self, url: str):
+        """Waits for a token and a free slot of the host of the url."""
+
+        wait = self.reserve()
+        if self.rate:
+            metrics.observe("dominos_throttle_wait_seconds", wait)
+        if wait:
+            logger.debug("Throttled %.3f seconds", wait)
+            time.sleep(wait)
+
+        if not self.max_per_host:
+            yield
+            return
+
+        host = urlsplit(url).netloc
+        with self._lock:
+            semaphore = self._host_semaphores.setdefault(
+                host, threading.BoundedSemaphore(self.max_per_host)
+            )
+        with semaphore:
+            yield
+
+    @asynccontextmanager
+    async def limit_async(self, url: str):
+        """Asyncio version of `limit`."""
+
+        wait = self.reserve()
+        if self.rate:
+            metrics.observe("dominos_throttle_wait_seconds", wait)
+        if wait:
+            logger.debug("Throttled %.3f seconds", wait)
+            await asyncio.sleep(wait)
+
+        if not self.max_per_host:
+            yield
+            return
+
+        # asyncio semaphores belong to an event loop.
+        loop = asyncio.get_running_loop()
+        host = urlsplit(url).netloc
+        with self._lock:
+            semaphores = self._async_host_semaphores.setdefault(loop, {})
+            semaphore = semaphores.setdefault(
+                host, asyncio.Semaphore(self.max_per_host)
+            )
+        async with semaphore:
+            yield
+
+
+class RetryBudget:
+    """Caps the retries to a fraction of the requests, so they can't amplify load.
+
+    The first attempt of each request deposits `ratio` tokens and each retry
+    withdraws one, so retries don't earn more retries. The budget starts with `min_retries` tokens so the first failures can be
+    retried.
+
+    Args:
+        ratio (float, optional): retries allowed for each request.
+            Defaults to 0.2.
+        min_retries (int, optional): initial and minimum number of tokens.
+            Defaults to 10.
+    """
+
+    def __init__(self, ratio=0.2, min_retries=10):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.max_tokens = max(min_retries, 100 * ratio)
+        self._tokens = float(min_retries)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """Takes a token for a retry. Returns False if there are none left."""
+
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class RetryPolicy:
+    """Decides which failures are retried and how long to wait before.
+
+    Delays grow exponentially with full jitter, and the `Retry-After` header
+    of the response is honoured if present.
+
+    Args:
+        backoff_factor (float, optional): delay of the first retry, doubled
+            after each retry. If none, it's set to settings.backoff_factor.
+            Defaults to None.
+        max_backoff (float, optional): maximum delay. If none, it's set to
+            settings.max_backoff. Defaults to None.
+        retry_statuses (Iterable[int], optional): HTTP status codes retried.
+            If none, it's set to settings.retry_statuses. Defaults to None.
+        budget (RetryBudget, optional): budget shared with other policies. If
+            none, retries are only limited by the number of retries.
+            Defaults to None.
+    """
+
+    def __init__(
+        self,
+        backoff_factor: Optional[float] = None,
+        max_backoff: Optional[float] = None,
+        retry_statuses: Optional[Iterable[int]] = None,
+        budget: Optional[RetryBudget] = None,
+    ):
+        if backoff_factor is None:
+            backoff_factor = settings.backoff_factor
+        if max_backoff is None:
+            max_backoff = settings.max_backoff
+        if retry_statuses is None:
+            retry_statuses = settings.retry_statuses
+
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.retry_statuses = frozenset(retry_statuses)
+        self.budget = budget
+
+        self.requests = 0
+        self.retries: Counter = Counter()
+        self.delay = 0.0
+        self.budget_exhausted = 0
+        self._lock = threading.Lock()
+
+    def is_retryable(self, status: int) -> bool:
+        return status in self.retry_statuses
+
+    def record_request(self, retry=False):
+        """Records an attempt. Only first attempts deposit in the budget."""
+
+        with self._lock:
+            self.requests += 1
+        if self.budget and not retry:
+            self.budget.deposit()
+
+    def get_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Returns the seconds to wait before a retry.
+
+        Args:
+            attempt (int): number of retries already made.
+            retry_after (str, optional): value of the Retry-After header.
+                Defaults to None.
+
+        Returns:
+            float: seconds to wait.
+        """
+
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            delay = random.uniform(0, self.backoff_factor * 2**attempt)
+        return min(delay, self.max_backoff)
+
+    def next_retry(
+        self, attempt: int, reason: str, retry_after: Optional[str] = None
+    ) -> Optional[float]:
+        """Records a failure and returns the seconds to wait before retrying.
+
+        Args:
+            attempt (int): number of retries already made.
+            reason (str): cause of the failure, used in the metrics.
+            retry_after (str, optional): value of the Retry-After header.
+                Defaults to None.
+
+        Returns:
+            Optional[float]: seconds to wait, or None if the retry budget is
+                exhausted.
+        """
+
+        if self.budget and not self.budget.withdraw():
+            with self._lock:
+                self.budget_exhausted += 1
+            return None
+
+        delay = self.get_delay(attempt, retry_after)
+        with self._lock:
+            self.retries[reason] += 1
+            self.delay += delay
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the number of requests and retries and the time waited."""
+
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": sum(self.retries.values()),
+                "retries_by_reason": dict(self.retries),
+                "delay": self.delay,
+                "budget_exhausted": self.budget_exhausted,
+            }
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Returns the seconds of a Retry-After header (seconds or HTTP date)."""
+
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_retry_policy: Optional[RetryPolicy] = None
+_retry_policy_config: Optional[tuple] = None
+_retry_policy_lock = threading.Lock()
+
+
+def get_retry_policy() -> RetryPolicy:
+    """Returns the retry policy of the downloaders without their own.
+
+    It's built from the backoff, retry statuses and retry budget settings, and
+    rebuilt if they change.
+    """
+
+    global _retry_policy, _retry_policy_config  # pylint: disable=global-statement
+
+    config = (
+        settings.backoff_factor,
+        settings.max_backoff,
+        tuple(settings.retry_statuses),
+        settings.retry_budget_ratio,
+        settings.retry_budget_min,
+    )
+    with _retry_policy_lock:
+        if _retry_policy is None or _retry_policy_config != config:
+            backoff_factor, max_backoff, retry_statuses, ratio, min_retries = config
+            _retry_policy = RetryPolicy(
+                backoff_factor,
+                max_backoff,
+                retry_statuses,
+                budget=RetryBudget(ratio, min_retries),
+            )
+            _retry_policy_config = config
+        return _retry_policy
+
+
+class CircuitBreaker:
+    """Fails fast while an endpoint keeps failing.
+
+    The circuit opens after `failure_threshold` consecutive failures. While
+    open, requests raise `CircuitOpenError` without reaching the server. After
+    `recovery_timeout` seconds it's half-open: a single request is let through
+    as a probe, which closes the circuit if it succeeds or opens it again if
+    it fails.
+
+    Args:
+        name (str): name of the endpoint, used in the logs.
+        failure_threshold (int, optional): consecutive failures that open the
+            circuit. If none, it's set to settings.breaker_failure_threshold.
+            Defaults to None.
+        recovery_timeout (float, optional): seconds the circuit stays open.
+            If none, it's set to settings.breaker_recovery_timeout.
+            Defaults to None.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name: str, failure_threshold=None, recovery_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or settings.breaker_failure_threshold
+        if recovery_timeout is None:
+            recovery_timeout = settings.breaker_recovery_timeout
+        self.recovery_timeout = recovery_timeout
+
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._get_state()
+
+    def _get_state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.recovery_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def retry_in(self) -> float:
+        """Returns the seconds until the circuit lets a probe through."""
+
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            elapsed = time.monotonic() - self.opened_at
+            return max(0.0, self.recovery_timeout - elapsed)
+
+    def before_request(self) -> bool:
+        """Checks if a request can be made.
+
+        Raises:
+            CircuitOpenError: if the circuit is open, or half-open with a
+                probe already in flight.
+
+        Returns:
+            bool: True if the request is the probe of a half-open circuit.
+                Its outcome must be recorded, or the probe aborted.
+        """
+
+        with self._lock:
+            state = self._get_state()
+            if state == self.CLOSED:
+                return False
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+
+        raise CircuitOpenError(f"circuit of {self.name} is open")
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("Circuit of %s closed", self.name)
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._probing:
+                    logger.warning("Circuit of %s opened", self.name)
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def abort_probe(self):
+        """Lets another probe through when the probe ended without telling if
+        the endpoint works, for example because it was cancelled."""
+
+        with self._lock:
+            self._probing = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_endpoint(url: str) -> Optional[str]:
+    """Returns the guarded endpoint of an url, or None."""
+
+    segments = urlsplit(url).path.split("/")
+    for endpoint in settings.breaker_endpoints:
+        if endpoint in segments:
+            return endpoint
+    return None
+
+
+def get_endpoint_label(url: str) -> str:
+    """Returns the endpoint of an url used to label its metrics."""
+
+    return get_endpoint(url) or urlsplit(url).path.rsplit("/", 1)[-1] or "/"
+
+
+def record_response_metrics(
+    endpoint: str, status: int, received: int, sent: Optional[int] = None
+):
+    metrics.increment("dominos_responses_total", endpoint=endpoint, status=status)
+    metrics.increment("dominos_response_bytes_total", received, endpoint=endpoint)
+    if sent is not None:
+        metrics.increment("dominos_request_bytes_total", sent, endpoint=endpoint)
+
+
+def get_breaker(url: str) -> Optional[CircuitBreaker]:
+    """Returns the circuit breaker of the endpoint of an url, shared by every
+    downloader of the process, or None if the endpoint is not guarded."""
+
+    endpoint = get_endpoint(url)
+    if endpoint is None:
+        return None
+    with _breakers_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker(endpoint)
+        return _breakers[endpoint]
+
+
+def get_open_breakers() -> List[CircuitBreaker]:
+    """Returns the circuit breakers not closed."""
+
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [x for x in breakers if x.state != CircuitBreaker.CLOSED]
+
+
+_throttle: Optional[Throttle] = None
+_throttle_lock = threading.Lock()
+
+
+def get_throttle() -> Throttle:
+    """Returns the throttle shared by every downloader of the process.
+
+    It's built from `settings.rate_limit`, `settings.burst` and
+    `settings.max_connections_per_host`, and rebuilt if they change.
+    """
+
+    global _throttle  # pylint: disable=global-statement
+
+    config = (settings.rate_limit, settings.burst, settings.max_connections_per_host)
+    with _throttle_lock:
+        if (
+            _throttle is None
+            or (
+                _throttle.rate,
+                _throttle.burst,
+                _throttle.max_per_host,
+            )
+            != config
+        ):
+            _throttle = Throttle(*config)
+        return _throttle
+
+
+class ConnectionStats:
+    """Counts the connections opened and the requests sent over them.
+
+    Requests not needing a new connection reused a kept-alive one, so they
+    skipped the TCP and TLS handshakes.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.new = 0
+        self._lock = threading.Lock()
+
+    @property
+    def reused(self) -> int:
+        return max(0, self.requests - self.new)
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_new(self):
+        with self._lock:
+            self.new += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"requests": self.requests, "new": self.new, "reused": self.reused}
+
+
+# Shared by every downloader of the process.
+connection_stats = ConnectionStats()
+
+
+# Connections that were closed are opened again by urllib3 without creating
+# a new connection object, so the handshakes are counted in `connect`.
+class _CountingHTTPConnection(HTTPConnection):
+    def connect(self):
+        connection_stats.record_new()
+        super().connect()
+
+
+class _CountingHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        connection_stats.record_new()
+        super().connect()
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTP adapter with the pool sizes of the settings that counts connections.
+
+    Args:
+        pool_connections (int, optional): number of hosts whose connections
+            are kept. If none, it's set to settings.pool_connections.
+            Defaults to None.
+        pool_maxsize (int, optional): maximum number of connections kept for
+            each host. It should be at least the number of threads sharing
+            the downloader, otherwise connections are discarded and opened
+            again. If none, it's set to settings.pool_maxsize.
+            Defaults to None.
+        pool_block (bool, optional): if True, requests wait for a free
+            connection instead of opening one that won't be kept. If none,
+            it's set to settings.pool_block. Defaults to None.
+    """
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, pool_block=None):
+        if pool_block is None:
+            pool_block = settings.pool_block
+        super().__init__(
+            pool_connections=pool_connections or settings.pool_connections,
+            pool_maxsize=pool_maxsize or settings.pool_maxsize,
+            pool_block=pool_block,
+        )
+
+    def init_poolmanager(self, *args, **kwargs):
+        if settings.tcp_keepalive:
+            kwargs["socket_options"] = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            ]
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        cassette = settings.cassette
+        if cassette is not None and cassette.mode == "replay":
+            return cassette.replay(self, request)
+
+        connection_stats.record_request()
+        start = time.monotonic()
+        response = super().send(request, **kwargs)
+        if cassette is not None:
+            cassette.record(request, response, time.monotonic() - start)
+        return response
+
+
 class Downloader(requests.Session):
     """Downloader with retries control.
 
@@ -29,18 +688,31 @@ class Downloader(requests.Session):
             Defaults to False.
         retries (int, optional): number of retries for each request. If none,
             it's set to settings.retries. Defaults to None.
+        limiter (RequestLimiter, optional): limiter shared with other
+            downloaders to cap the in-flight requests. Defaults to None.
+        retry_policy (RetryPolicy, optional): backoff and retried status
+            codes. If none, the shared `get_retry_policy()` is used.
+            Defaults to None.
     """
 
-    def __init__(self, silenced=False, retries=None):
+    def __init__(self, silenced=False, retries=None, limiter=None, retry_policy=None):
         self.logger = logging.getLogger(__name__)
         self.retries = retries or settings.retries
         self.timeout = settings.timeout
+        self.limiter = limiter
+        self.retry_policy = retry_policy
 
         if silenced is True:
             self.logger.setLevel(logging.CRITICAL)
 
         super().__init__()
         self.headers.update(**NEW_HEADERS)
+        if not settings.keep_alive:
+            self.headers["Connection"] = "close"
+
+        adapter = PooledAdapter()
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
 
     # pylint: disable=arguments-differ
     def request(self, method, url, retries=None, **kwargs) -> requests.Response:
@@ -53,24 +725,75 @@ class Downloader(requests.Session):
             **kwargs: keyword arguments passed to requests.Session.request.
 
         Raises:
+            CircuitOpenError: if the circuit breaker of the endpoint is open.
             DownloaderError: if all retries failed.
 
         Returns:
-            requests.Response: HTTP response.
+            requests.Response: HTTP response. If its status code is retryable
+                and all retries failed, the last response is returned.
         """
 
         self.logger.debug("%s %r", method, url)
         retries = retries or self.retries
+        policy = self.retry_policy or get_retry_policy()
+        breaker = get_breaker(url)
+        endpoint = get_endpoint_label(url) if metrics.enabled() else None
+        response = None
 
-        while retries > 0:
+        for attempt in range(retries):
+            probe = breaker.before_request() if breaker else False
+            policy.record_request(retry=attempt > 0)
+            retry_after = None
             try:
-                return super().request(method, url, **kwargs)
+                with get_throttle().limit(url), self.limiter or nullcontext():
+                    with metrics.timed(
+                        "dominos_request_seconds", endpoint=endpoint, method=method
+                    ):
+                        response = super().request(method, url, **kwargs)
+                if endpoint:
+                    body = response.request.body or b""
+                    record_response_metrics(
+                        endpoint, response.status_code, len(response.content), len(body)
+                    )
             except requests.exceptions.RequestException as exc:
-                excname = type(exc).__name__
-                retries -= 1
-                self.logger.warning(
-                    "Catched %s in %s, retries=%s", excname, method, retries
+                reason = type(exc).__name__
+                response = None
+                metrics.increment(
+                    "dominos_request_errors_total", endpoint=endpoint, error=reason
                 )
+            except BaseException:
+                # Interrupted or failed for other reasons than the server.
+                if probe:
+                    breaker.abort_probe()
+                raise
+            else:
+                if not policy.is_retryable(response.status_code):
+                    if breaker:
+                        breaker.record_success()
+                    return response
+                reason = f"HTTP {response.status_code}"
+                retry_after = response.headers.get("Retry-After")
+
+            if breaker:
+                breaker.record_failure()
+
+            remaining = retries - attempt - 1
+            self.logger.warning(
+                "Catched %s in %s, retries=%s", reason, method, remaining
+            )
+            if not remaining:
+                break
+
+            delay = policy.next_retry(attempt, reason, retry_after)
+            if delay is None:
+                self.logger.warning("Retry budget exhausted in %s %r", method, url)
+                break
+            metrics.increment("dominos_retries_total", endpoint=endpoint, reason=reason)
+            metrics.observe("dominos_retry_delay_seconds", delay, endpoint=endpoint)
+            time.sleep(delay)
+
+        if response is not None:
+            return response
 
         self.logger.critical("Download error in %s %r", method, url)
         raise DownloaderError("max retries failed.")
@@ -0,0 +1,292 @@
+"""HTML parsing helpers shared by the sync and async checkers.
+
+The parsing backend is selected with `settings.backend`:
+
+- ``html.parser``: BeautifulSoup with the pure python parser (default).
+- ``lxml``: BeautifulSoup with lxml, which must be installed.
+- ``regex``: the wanted elements are cut out of the page with regular
+  expressions and only those snippets are parsed with ``html.parser``.
+
+BeautifulSoup backends only build the elements each call site needs, through
+a `SoupStrainer`.
+"""
+
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.element import Tag
+from dateutil.parser import parse
+from unidecode import unidecode
+
+from .schemas import AppliedPromotion, OrderType
+
+BACKENDS = ("html.parser", "lxml", "regex")
+
+
+class _settings:
+    backend = "html.parser"
+
+
+settings = _settings()
+del _settings
+
+
+def parse_elements(html: str, name: str, id=None, class_=None) -> List[Tag]:
+    """Parses only the elements of the page matching a tag, id and class.
+
+    Args:
+        html (str): HTML to parse.
+        name (str): tag name of the elements.
+        id (str, optional): id of the elements. Defaults to None.
+        class_ (str, optional): one of the classes of the elements.
+            Defaults to None.
+
+    Raises:
+        ValueError: if `settings.backend` is not a valid backend.
+
+    Returns:
+        List[Tag]: matching elements, in page order.
+    """
+
+    # pylint: disable=redefined-builtin
+    attrs = {}
+    if id is not None:
+        attrs["id"] = id
+    if class_ is not None:
+        attrs["class"] = class_
+
+    if settings.backend not in BACKENDS:
+        raise ValueError(f"Invalid parsing backend: {settings.backend!r}")
+
+    if settings.backend == "regex":
+        snippets = extract_elements(html, name, id=id, class_=class_)
+        return [
+            BeautifulSoup(x, "html.parser").find(name, attrs=attrs) for x in snippets
+        ]
+
+    strainer_attrs = dict(attrs)
+    if class_ is not None:
+        # While parsing, the strainer sees the raw class attribute.
+        strainer_attrs["class"] = _get_class_matcher(class_)
+
+    strainer = SoupStrainer(name, attrs=strainer_attrs)
+    soup = BeautifulSoup(html, settings.backend, parse_only=strainer)
+    return soup.find_all(name, attrs=attrs)
+
+
+@lru_cache()
+def _get_class_matcher(class_: str):
+    def matcher(value):
+        if not value:
+            return False
+        if isinstance(value, str):
+            value = value.split()
+        return class_ in value
+
+    return matcher
+
+
+def extract_elements(html: str, name: str, id=None, class_=None) -> List[str]:
+    """Cuts out the raw HTML of the elements matching a tag, id and class.
+
+    The page is not parsed, the elements are found with regular expressions
+    and their end is found by counting the nested tags with the same name.
+
+    Args:
+        html (str): HTML to search in.
+        name (str): tag name of the elements.
+        id (str, optional): id of the elements. Defaults to None.
+        class_ (str, optional): one of the classes of the elements.
+            Defaults to None.
+
+    Returns:
+        List[str]: HTML of each matching element, in page order.
+    """
+
+    # pylint: disable=redefined-builtin
+    pattern = _get_start_pattern(name, id, class_)
+    tag_pattern = _get_tag_pattern(name)
+
+    elements = []
+    match = pattern.search(html)
+    while match:
+        end = _find_element_end(html, match.start(), tag_pattern)
+        elements.append(html[match.start() : end])
+        match = pattern.search(html, end)
+    return elements
+
+
+@lru_cache()
+def _get_start_pattern(name: str, id=None, class_=None):
+    # pylint: disable=redefined-builtin
+    attrs = ""
+    if id is not None:
+        attrs += rf"""(?=[^>]*\bid=["']{re.escape(id)}["'])"""
+    if class_ is not None:
+        attrs += (
+            rf"""(?=[^>]*\bclass=["'][^"']*(?<![\w-]){re.escape(class_)}(?![\w-]))"""
+        )
+    return re.compile(rf"<{name}\b{attrs}", re.IGNORECASE)
+
+
+@lru_cache()
+def _get_tag_pattern(name: str):
+    return re.compile(rf"<(/?){name}\b", re.IGNORECASE)
+
+
+def _find_element_end(html: str, start: int, tag_pattern) -> int:
+    depth = 0
+    for match in tag_pattern.finditer(html, start):
+        depth += -1 if match.group(1) else 1
+        if depth == 0:
+            return html.index(">", match.end()) + 1
+    return len(html)
+
+
+def parse_token(html: str) -> str:
+    """Extracts the anti-forgery token from the promotions page.
+
+    Args:
+        html (str): HTML of the promotions page.
+
+    Raises:
+        ValueError: if the page does not contain the AjaxAntiForgeryForm.
+
+    Returns:
+        str: the `__RequestVerificationToken` value.
+    """
+
+    token_containers = parse_elements(html, "form", id="__AjaxAntiForgeryForm")
+    if not token_containers:
+        raise ValueError("Can't get AjaxAntiForgeryForm token")
+
+    return token_containers[0].input["value"]
+
+
+def parse_promotions(html: str, order_type: OrderType) -> List[AppliedPromotion]:
+    """Extracts the applied promotions from the promotions page.
+
+    Args:
+        html (str): HTML of the promotions page.
+        order_type (OrderType): order type of the current order.
+
+    Raises:
+        ValueError: if the page does not contain any promotion.
+
+    Returns:
+        List[AppliedPromotion]: promotions applied to the current order.
+    """
+
+    promotions_container = parse_elements(html, "div", class_="promo-content")
+
+    if not promotions_container:
+        raise ValueError("Can't get promotions container")
+
+    return [_build_promotion(x, order_type) for x in promotions_container]
+
+
+def _build_promotion(container, order_type: OrderType) -> AppliedPromotion:
+    description = container.find("h3").text.strip()
+    expires_container = container.find("div", class_="promo-description")
+    expires_text = unidecode(expires_container.text).strip(" .")
+    expires = expires_text.split()[-1].strip(". ")
+    expires = parse(expires).date()
+    return AppliedPromotion(
+        order_type=order_type, description=description, expires=expires
+    )
+
+
+def promotion_key(promotion: AppliedPromotion) -> Tuple[OrderType, str, Any]:
+    """Hashable fingerprint of an applied promotion."""
+
+    return promotion.order_type, promotion.description, promotion.expires
+
+
+class PromotionTracker:
+    """Keeps track of the promotions applied to an order, incrementally.
+
+    Only the `promo-content` blocks not seen before are parsed, and the
+    promotions are deduplicated through fingerprint sets.
+    """
+
+    def __init__(self):
+        self.promotions: List[AppliedPromotion] = []
+        self._keys: Set[Tuple[OrderType, str, Any]] = set()
+        self._blocks: Set[Tuple[OrderType, int]] = set()
+
+    def __contains__(self, promotion: AppliedPromotion) -> bool:
+        return promotion_key(promotion) in self._keys
+
+    def __iter__(self):
+        return iter(self.promotions)
+
+    def __len__(self):
+        return len(self.promotions)
+
+    def add(self, promotion: AppliedPromotion) -> bool:
+        """Registers a promotion. Returns False if it was already applied."""
+
+        key = promotion_key(promotion)
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        self.promotions.append(promotion)
+        return True
+
+    def update(self, html: str, order_type: OrderType) -> List[AppliedPromotion]:
+        """Registers the promotions of the promotions page.
+
+        Args:
+            html (str): HTML of the promotions page, or a fragment of it.
+            order_type (OrderType): order type of the current order.
+
+        Raises:
+            ValueError: if the page does not contain any promotion.
+
+        Returns:
+            List[AppliedPromotion]: promotions not applied before.
+        """
+
+        blocks = extract_elements(html, "div", class_="promo-content")
+        if not blocks:
+            raise ValueError("Can't get promotions container")
+
+        new_promotions = []
+        for block in blocks:
+            block_key = (order_type, hash(block))
+            if block_key in self._blocks:
+                continue
+            self._blocks.add(block_key)
+
+            container = parse_elements(block, "div", class_="promo-content")[0]
+            promotion = _build_promotion(container, order_type)
+            if self.add(promotion):
+                new_promotions.append(promotion)
+
+        return new_promotions
+
+    def update_from_response(
+        self, data: Dict[str, Any], order_type: OrderType
+    ) -> Optional[List[AppliedPromotion]]:
+        """Registers the promotions sent in the AplicarCodPromo response.
+
+        Args:
+            data (Dict[str, Any]): JSON response of AplicarCodPromo.
+            order_type (OrderType): order type of the current order.
+
+        Returns:
+            Optional[List[AppliedPromotion]]: promotions not applied before,
+                or None if the response does not include any promotion.
+        """
+
+        fragments = [
+            value
+            for value in data.values()
+            if isinstance(value, str)
+            and extract_elements(value, "div", class_="promo-content")
+        ]
+        if not fragments:
+            return None
+        return self.update("".join(fragments), order_type)
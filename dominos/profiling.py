@@ -0,0 +1,123 @@
+"""Profiling of a block of code: CPU time with cProfile, wall time by sampling.
+
+Each profile is written as two files sharing a prefix:
+
+- `<prefix>.pstats`: cProfile stats measured with the CPU time of the thread,
+  readable with `pstats` or snakeviz. Time waiting for the network is not
+  counted, so it shows where the CPU goes (BeautifulSoup, dateutil...).
+- `<prefix>.collapsed`: stacks of the thread sampled every few milliseconds
+  of wall time, in the collapsed format of flamegraph.pl and speedscope.
+  Network waits show up as the socket frames they block in.
+"""
+
+import cProfile
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from types import FrameType
+from typing import Iterator, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Samples the stack of a thread from a background thread.
+
+    Args:
+        thread_id (int): identifier of the thread sampled.
+        interval (float, optional): seconds between samples. Defaults to 0.005.
+    """
+
+    def __init__(self, thread_id: int, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="dominos-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(  # pylint: disable=protected-access
+                self.thread_id
+            )
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def to_collapsed(self) -> str:
+        return "".join(f"{x} {y}\n" for x, y in sorted(self.stacks.items()))
+
+
+class Profiler:
+    """Profiles the calling thread, see the module docstring.
+
+    Args:
+        interval (float, optional): seconds between wall time samples.
+            Defaults to 0.005.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.profile: Optional[cProfile.Profile] = cProfile.Profile(time.thread_time)
+        self.sampler = StackSampler(threading.get_ident(), interval)
+
+    def start(self):
+        self.sampler.start()
+        try:
+            self.profile.enable()
+        except ValueError:
+            # Since Python 3.12 only one cProfile can be active in a process.
+            logger.warning("Another profiler is active, CPU time is not profiled")
+            self.profile = None
+
+    def stop(self):
+        if self.profile:
+            self.profile.disable()
+        self.sampler.stop()
+
+    def dump(self, prefix: Union[str, Path]):
+        """Writes `<prefix>.pstats` and `<prefix>.collapsed`."""
+
+        prefix = Path(prefix)
+        if self.profile:
+            self.profile.dump_stats(str(prefix.with_name(prefix.name + ".pstats")))
+        prefix.with_name(prefix.name + ".collapsed").write_text(
+            self.sampler.to_collapsed(), "utf8"
+        )
+
+
+@contextmanager
+def profile(prefix: Union[str, Path], interval=0.005) -> Iterator[Profiler]:
+    """Profiles the block and writes the results, see `Profiler.dump`."""
+
+    profiler = Profiler(interval)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        profiler.dump(prefix)
@@ -0,0 +1,125 @@
+"""Ordering of the codes to check, so the working ones are found first."""
+
+import time
+from typing import Iterable, Iterator, List, Optional
+
+from .cache import DAY, ResultCache
+from .schemas import OrderType, Shop
+from .utils import distance
+
+
+class Budget:
+    """Limits the number of codes checked or the time spent checking them.
+
+    Args:
+        max_checks (int, optional): maximum number of codes checked.
+            Defaults to None.
+        max_seconds (float, optional): maximum seconds spent checking codes.
+            Defaults to None.
+    """
+
+    def __init__(self, max_checks: Optional[int] = None, max_seconds=None):
+        self.max_checks = max_checks
+        self.max_seconds = max_seconds
+
+    def remaining(self, checks: int, seconds: float) -> "Budget":
+        """Returns the budget left after checking some codes for some seconds."""
+
+        max_checks = max_seconds = None
+        if self.max_checks is not None:
+            max_checks = max(0, self.max_checks - checks)
+        if self.max_seconds is not None:
+            max_seconds = max(0.0, self.max_seconds - seconds)
+        return Budget(max_checks, max_seconds)
+
+    def limit(self, codes: Iterable[str]) -> Iterator[str]:
+        """Yields codes until the budget is exhausted."""
+
+        start = time.monotonic()
+        for checked, code in enumerate(codes):
+            if self.max_checks is not None and checked >= self.max_checks:
+                return
+            if self.max_seconds is not None:
+                if time.monotonic() - start >= self.max_seconds:
+                    return
+            yield code
+
+
+class CodeScheduler:
+    """Sorts the codes by their chances of working in a shop.
+
+    The score of each code combines its hit rate in the shop, how recently it
+    worked there, its hit rate in the closest shops and its global hit rate.
+    Statistics are read from a `ResultCache`, which records them while the
+    codes are checked.
+
+    Args:
+        cache (ResultCache): cache with the statistics of the codes.
+        neighbours (int, optional): number of closest shops used.
+            Defaults to 5.
+        half_life (float, optional): seconds after which the recency score
+            of a hit is halved. Defaults to 30 days.
+    """
+
+    shop_weight = 4
+    recency_weight = 2
+    neighbours_weight = 2
+    global_weight = 1
+
+    def __init__(self, cache: ResultCache, neighbours=5, half_life=30 * DAY):
+        self.cache = cache
+        self.neighbours = neighbours
+        self.half_life = half_life
+
+    def order(
+        self, codes: Iterable[str], shop: Shop, order_type: OrderType
+    ) -> List[str]:
+        """Sorts the codes, most promising first.
+
+        Args:
+            codes (Iterable[str]): codes to sort.
+            shop (Shop): shop where the codes are going to be checked.
+            order_type (OrderType): order type of the checks.
+
+        Returns:
+            List[str]: sorted codes. Codes without statistics keep their
+                relative order.
+        """
+
+        now = time.time()
+        shop_stats = self.cache.get_stats(order_type, [shop.id])
+        neighbour_stats = self.cache.get_stats(order_type, self.get_neighbours(shop))
+        global_stats = self.cache.get_stats(order_type)
+
+        def score(code):
+            checks, hits, last_hit = shop_stats.get(code, (0, 0, None))
+            value = self.shop_weight * self.hit_rate(checks, hits)
+            if last_hit is not None:
+                age = max(0, now - last_hit)
+                value += self.recency_weight * 0.5 ** (age / self.half_life)
+
+            checks, hits, _ = neighbour_stats.get(code, (0, 0, None))
+            value += self.neighbours_weight * self.hit_rate(checks, hits)
+
+            checks, hits, _ = global_stats.get(code, (0, 0, None))
+            value += self.global_weight * self.hit_rate(checks, hits)
+            return value
+
+        return sorted(codes, key=score, reverse=True)
+
+    def get_neighbours(self, shop: Shop) -> List[int]:
+        """Returns the ids of the closest known shops, excluding the shop."""
+
+        shops = self.cache.get_shops()
+        shops.pop(shop.id, None)
+
+        def shop_distance(shop_id):
+            lat, long = shops[shop_id]
+            return distance(shop.coords.lat, shop.coords.long, lat, long)
+
+        return sorted(shops, key=shop_distance)[: self.neighbours]
+
+    @staticmethod
+    def hit_rate(checks: int, hits: int) -> float:
+        # Laplace smoothing, so codes never checked get a neutral score.
+        return (hits + 1) / (checks + 2)
@@ -1,6 +1,12 @@
+import math
+import os
+from pathlib import Path
+
 import unidecode
 
-BASE_URL = "https://www.dominospizza.es/"
+# Can be overridden at runtime with `dominos.networking.settings.base_url`.
+BASE_URL = os.environ.get("DOMINOS_BASE_URL", "https://www.dominospizza.es/")
+EARTH_RADIUS_KM = 6371
 
 
 class MetaSingleton(type):
@@ -24,3 +30,22 @@ def remove_accents(string: str) -> str:
     if isinstance(result, str):
         return result
     return result.decode("utf8")
+
+
+def distance(lat1: float, long1: float, lat2: float, long2: float) -> float:
+    """Great-circle distance in kilometers between two points."""
+
+    lat1, long1, lat2, long2 = map(math.radians, (lat1, long1, lat2, long2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((long2 - long1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def write_atomic(path: Path, data: str):
+    """Writes a text file so readers never see it half written."""
+
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(data, "utf8")
+    os.replace(tmp_path, path)
@@ -1,10 +1,45 @@
+import json
+import marshal
+import os
+import sys
+
 import versioneer
 from setuptools import setup
 
+cmdclass = versioneer.get_cmdclass()
+
+
+class build_py(cmdclass["build_py"]):
+    """Also precompiles the locations data into a marshal file."""
+
+    def run(self):
+        super().run()
+        folder = os.path.join(self.build_lib, "dominos", "locations")
+        if not os.path.isdir(folder):
+            return
+
+        json_path = os.path.join("dominos", "locations", "provinces-cities-ids.json")
+        with open(json_path, encoding="utf8") as file_handler:
+            data = json.load(file_handler)
+        compiled_path = os.path.join(folder, "provinces-cities-ids.marshal")
+        # Tagged like dominos.locations.compile_provinces does.
+        with open(compiled_path, "wb") as file_handler:
+            marshal.dump((sys.implementation.cache_tag, data), file_handler)
+
+
+cmdclass["build_py"] = build_py
+
 setup(
     name="dominos",
     author="sralloza",
     license="mit",
     version=versioneer.get_version(),
-    cmdclass=versioneer.get_cmdclass(),
+    cmdclass=cmdclass,
+    package_data={
+        "dominos": [
+            "codes/codes.txt",
+            "locations/provinces-cities-ids.json",
+            "locations/province-ids.json",
+        ]
+    },
 )
@@ -0,0 +1,29 @@
+import pytest
+
+from dominos import main, networking
+from dominos.fakeserver import FakeServer
+from dominos.schemas import Address
+
+ADDRESS = Address(
+    province="a coruña", city="arteixo", street_name="calle mayor", street_number=1
+)
+
+# Both codes give the same promotion, so only the first one is reported.
+VALID_CODES = {"10FAM": "Pizza A", "ZPA356": "Pizza A"}
+CODES = ["10FAM", "1126", "ZPA356", "2X1DOM"]
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(main, "get_codes", lambda: list(CODES))
+    # Circuit breakers are shared by the process, so each test gets its own.
+    monkeypatch.setattr(networking, "_breakers", {})
+    with FakeServer(VALID_CODES) as server:
+        yield server
+
+
+def get_codes(infos):
+    return [
+        {x: [y.code for y in codes] for x, codes in info.order_types.items()}
+        for info in infos
+    ]
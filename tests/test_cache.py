@@ -0,0 +1,31 @@
+from dominos import main
+from dominos.cache import ResultCache, SQLiteStore
+from dominos.schemas import OrderType
+
+from .conftest import ADDRESS
+
+
+def test_accepted_codes_are_cached_as_working(server, tmp_path):
+    (info,) = main.update_codes([ADDRESS], base_folder=tmp_path, cache=True)
+
+    cache = ResultCache.in_folder(tmp_path)
+    for order_type in OrderType:
+        # ZPA356 gives the promotion of 10FAM, so it's not reported but works.
+        assert cache.last_result("ZPA356", info.shop.id, order_type) is True
+        assert cache.last_result("1126", info.shop.id, order_type) is False
+
+
+def test_opened_stores_are_closed(server, monkeypatch, tmp_path):
+    closed = []
+    close = SQLiteStore.close
+
+    def recording_close(self):
+        closed.append(type(self).__name__)
+        close(self)
+
+    monkeypatch.setattr(SQLiteStore, "close", recording_close)
+    main.update_codes(
+        [ADDRESS], base_folder=tmp_path, cache=True, shop_cache=True, journal=True
+    )
+
+    assert sorted(closed) == ["Journal", "ResultCache", "ShopCache"]
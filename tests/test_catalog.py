@@ -0,0 +1,42 @@
+import random
+
+import pytest
+
+from dominos.catalog import ShopCatalog, to_point, _squared_distance
+from dominos.schemas import Coords, OrderType, Shop
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    rand = random.Random(0)
+    shops = [
+        Shop(
+            id=n,
+            name=f"Calle {n}, {n}, 28000, Madrid",
+            phone=900000000 + n,
+            schedule="L-D: 12:00 - 00:00",
+            types=list(OrderType),
+            coords=Coords(lat=rand.uniform(36, 44), long=rand.uniform(-9, 3)),
+        )
+        for n in range(2000)
+    ]
+    return ShopCatalog(shops)
+
+
+def brute_force(catalog, lat, long):
+    point = to_point(lat, long)
+    return sorted(
+        catalog,
+        key=lambda x: _squared_distance(point, to_point(x.coords.lat, x.coords.long)),
+    )
+
+
+@pytest.mark.parametrize("k", [1, 5, 50])
+def test_nearest_shops(catalog, k):
+    expected = brute_force(catalog, 40, -3)[:k]
+    assert [x.id for x in catalog.nearest_shops(40, -3, k)] == [x.id for x in expected]
+
+
+@pytest.mark.parametrize("k", [0, -1])
+def test_nearest_shops_none(catalog, k):
+    assert catalog.nearest_shops(40, -3, k) == []
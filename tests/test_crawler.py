@@ -0,0 +1,58 @@
+import pytest
+
+from dominos import crawler, locations
+from dominos.crawler import ShopCrawler
+from dominos.exceptions import ShopNotFoundError
+from dominos.schemas import Coords, OrderType, Shop
+
+
+class FakeResponse:
+    headers = {"content-type": "text/html; charset=utf-8"}
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeSession:
+    def __init__(self, text: str):
+        self.text = text
+
+    def post(self, url, data=None):
+        return FakeResponse(self.text)
+
+
+def build_shop(id: int) -> Shop:
+    return Shop(
+        id=id,
+        name=f"Calle {id}, {id}, 28000, Madrid",
+        phone=900000000 + id,
+        schedule="L-D: 12:00 - 00:00",
+        types=list(OrderType),
+        coords=Coords(lat=40, long=-3),
+    )
+
+
+@pytest.mark.parametrize(
+    "html",
+    [
+        '<div class="tiendas"><ul class="listTiendas"></ul></div>',
+        '<div class="tiendas"></div>',
+    ],
+)
+def test_find_shops_without_shops(html):
+    with pytest.raises(ShopNotFoundError):
+        locations.find_shops(1, "1", "CALLE MAYOR", 1, session=FakeSession(html))
+
+
+def test_crawl_city_merges_streets(monkeypatch, tmp_path):
+    served = {"CALLE MAYOR": [1, 2], "CALLE REAL": [], "PLAZA MAYOR": [2, 3]}
+
+    def find_shops(province_id, city_id, street_name, street_number, session=None):
+        if not served[street_name]:
+            raise ShopNotFoundError(street_name)
+        return [build_shop(x) for x in served[street_name]]
+
+    monkeypatch.setattr(crawler, "find_shops", find_shops)
+    shop_crawler = ShopCrawler(tmp_path, streets=[(x, 1) for x in served])
+
+    assert [x.id for x in shop_crawler.crawl_city(1, "1")] == [1, 2, 3]
@@ -0,0 +1,111 @@
+import json
+import signal
+import threading
+import time
+from concurrent.futures import Future
+
+from dominos import main
+from dominos.cache import Journal, ShopCache
+from dominos.daemon import RefreshDaemon
+
+from .conftest import ADDRESS, CODES
+
+INTERVAL = 3600
+
+
+def test_existing_files_are_not_refreshed(server, monkeypatch, tmp_path):
+    main.update_codes([ADDRESS], base_folder=tmp_path)
+
+    checked = []
+    check_code = main.Dominos._check_code
+    monkeypatch.setattr(
+        main.Dominos,
+        "_check_code",
+        lambda self, code: checked.append(code) or check_code(self, code),
+    )
+
+    daemon = RefreshDaemon([ADDRESS], tmp_path, interval=INTERVAL)
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    time.sleep(0.2)
+    daemon.stop()
+    thread.join()
+
+    assert checked == []
+    ((due, _, _),) = daemon._queue  # pylint: disable=protected-access
+    assert time.time() + INTERVAL - 5 < due <= time.time() + INTERVAL
+
+
+def test_retry_delay_is_capped(tmp_path):
+    daemon = RefreshDaemon([ADDRESS], tmp_path, interval=INTERVAL, retry_delay=60)
+    ((key, shop),) = daemon.shops.items()
+    shop.failures = 20
+
+    future = Future()
+    future.set_exception(RuntimeError("failed"))
+    daemon._in_flight[key] = future  # pylint: disable=protected-access
+    daemon._on_done(key, future)  # pylint: disable=protected-access
+
+    ((due, _, _),) = daemon._queue  # pylint: disable=protected-access
+    assert due <= time.time() + INTERVAL
+
+
+def test_stop_between_codes_and_resume(server, monkeypatch, tmp_path):
+    check_code = main.Dominos._check_code
+    checked = []
+    daemon = RefreshDaemon([ADDRESS], tmp_path, interval=INTERVAL)
+
+    def stopping_check_code(self, code):
+        checked.append(code)
+        if code == "1126":
+            daemon.stop()
+        return check_code(self, code)
+
+    monkeypatch.setattr(main.Dominos, "_check_code", stopping_check_code)
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    thread.join(10)
+
+    assert not thread.is_alive()
+    assert checked == ["10FAM", "1126"]
+    state = json.loads((tmp_path / "refresh-state.json").read_text("utf8"))
+    assert state["in_flight"] == [ShopCache.get_key(ADDRESS)]
+
+    def counting_check_code(self, code):
+        checked.append(code)
+        return check_code(self, code)
+
+    checked.clear()
+    monkeypatch.setattr(main.Dominos, "_check_code", counting_check_code)
+    daemon = RefreshDaemon([ADDRESS], tmp_path, interval=INTERVAL)
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    for _ in range(100):
+        if all(x.updated for x in daemon.shops.values()):
+            break
+        time.sleep(0.05)
+    daemon.stop()
+    thread.join()
+
+    assert checked == ["ZPA356", "2X1DOM", *CODES]
+    journal = Journal.in_folder(tmp_path)
+    assert journal.execute("SELECT COUNT(*) FROM codes") == [(0,)]
+    journal.close()
+
+
+def test_signal_stops_shop_lookups(server, monkeypatch, tmp_path):
+    get_shop = ShopCache.get_shop
+    looked_up = []
+
+    def interrupted_get_shop(self, address, **kwargs):
+        looked_up.append(address)
+        signal.raise_signal(signal.SIGINT)
+        return get_shop(self, address, **kwargs)
+
+    monkeypatch.setattr(ShopCache, "get_shop", interrupted_get_shop)
+    addresses = [ADDRESS, ADDRESS.copy(update={"street_number": 2})]
+    daemon = RefreshDaemon(addresses, tmp_path, interval=INTERVAL)
+    daemon.run()
+
+    assert looked_up == [ADDRESS]
+    assert signal.getsignal(signal.SIGINT) is signal.default_int_handler
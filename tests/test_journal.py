@@ -0,0 +1,63 @@
+import pytest
+
+from dominos import main
+from dominos.cache import Journal
+
+from .conftest import ADDRESS, CODES, get_codes
+
+
+class Crash(BaseException):
+    pass
+
+
+def test_resume_after_crash(server, monkeypatch, tmp_path):
+    expected = get_codes(main.update_codes([ADDRESS], base_folder=tmp_path / "clean"))
+    assert expected == [{"recoger": ["10FAM"], "domicilio": ["10FAM"]}]
+
+    check_code = main.Dominos._check_code
+    checked = []
+
+    def crashing_check_code(self, code):
+        if code == "ZPA356":
+            raise Crash(code)
+        checked.append(code)
+        return check_code(self, code)
+
+    folder = tmp_path / "resumed"
+    monkeypatch.setattr(main.Dominos, "_check_code", crashing_check_code)
+    with pytest.raises(Crash):
+        main.update_codes([ADDRESS], base_folder=folder, journal=True)
+    assert checked == ["10FAM", "1126"]
+
+    def counting_check_code(self, code):
+        checked.append(code)
+        return check_code(self, code)
+
+    checked.clear()
+    monkeypatch.setattr(main.Dominos, "_check_code", counting_check_code)
+    infos = main.update_codes([ADDRESS], base_folder=folder, journal=True)
+
+    assert get_codes(infos) == expected
+    # Only the second order type checks again the codes checked before the crash.
+    assert checked == ["ZPA356", "2X1DOM", *CODES]
+    journal = Journal.in_folder(folder)
+    assert journal.execute("SELECT COUNT(*) FROM shops") == [(0,)]
+
+
+def test_failed_shops_dont_keep_journal(server, monkeypatch, tmp_path):
+    check_code = main.Dominos._check_code
+    checked = []
+
+    def counting_check_code(self, code):
+        checked.append(code)
+        return check_code(self, code)
+
+    monkeypatch.setattr(main.Dominos, "_check_code", counting_check_code)
+    missing = ADDRESS.copy(update={"city": "ciudad inexistente"})
+    addresses = [ADDRESS, missing]
+
+    for _ in range(2):
+        checked.clear()
+        infos = main.update_codes(addresses, base_folder=tmp_path, journal=True)
+        assert len(infos) == 1
+        assert checked == [*CODES, *CODES]
@@ -0,0 +1,34 @@
+import marshal
+
+import pytest
+
+from dominos import locations
+
+
+@pytest.fixture
+def compiled(monkeypatch, tmp_path):
+    path = tmp_path / "provinces-cities-ids.marshal"
+    locations.compile_provinces(path)
+    monkeypatch.setattr(locations, "compiled_path", path)
+    locations.get_provinces.cache_clear()
+    yield path
+    locations.get_provinces.cache_clear()
+
+
+def test_compiled_without_json(compiled, monkeypatch, tmp_path):
+    expected = locations.load_compiled_provinces(compiled)
+    monkeypatch.setattr(locations, "json_path", tmp_path / "missing.json")
+
+    assert locations.get_provinces() is not None
+    assert locations.get_provinces() == expected
+
+
+@pytest.mark.parametrize(
+    "content",
+    [marshal.dumps(("cpython-00", {})), marshal.dumps({}), b"not marshal"],
+)
+def test_unusable_compiled_falls_back_to_json(compiled, content):
+    compiled.write_bytes(content)
+
+    assert locations.load_compiled_provinces(compiled) is None
+    assert "madrid" in locations.get_provinces()
@@ -0,0 +1,55 @@
+from dominos import main
+from dominos.scheduler import Budget
+
+from .conftest import ADDRESS, get_codes
+
+
+def test_expired_session_is_renewed(server, monkeypatch, tmp_path):
+    check_code = main.Dominos._check_code
+    checked = []
+
+    def expiring_check_code(self, code):
+        if code == "ZPA356" and code not in checked:
+            server.sessions.clear()
+        checked.append(code)
+        return check_code(self, code)
+
+    monkeypatch.setattr(main.Dominos, "_check_code", expiring_check_code)
+    infos = main.update_codes([ADDRESS], base_folder=tmp_path)
+
+    # The new session knows the promotion of 10FAM was already found.
+    assert get_codes(infos) == [{"recoger": ["10FAM"], "domicilio": ["10FAM"]}]
+    assert checked[:5] == ["10FAM", "1126", "ZPA356", "ZPA356", "2X1DOM"]
+
+
+def test_too_many_expired_sessions(server, monkeypatch, tmp_path):
+    def expiring_check_code(self, code):
+        server.sessions.clear()
+        return check_code(self, code)
+
+    check_code = main.Dominos._check_code
+    monkeypatch.setattr(main.Dominos, "_check_code", expiring_check_code)
+
+    assert main.update_codes([ADDRESS], base_folder=tmp_path) == []
+
+
+def test_budget_covers_renewed_sessions(server, monkeypatch, tmp_path):
+    check_code = main.Dominos._check_code
+    checked = []
+
+    def expiring_check_code(self, code):
+        if code == "ZPA356" and code not in checked:
+            server.sessions.clear()
+        checked.append(code)
+        return check_code(self, code)
+
+    monkeypatch.setattr(main.Dominos, "_check_code", expiring_check_code)
+    main.update_codes([ADDRESS], base_folder=tmp_path, budget=Budget(max_checks=3))
+
+    # Expired checks are repeated, within the budget of 3 codes. The session
+    # warmed for the second order type expires too if it was warmed before.
+    assert checked[:4] == ["10FAM", "1126", "ZPA356", "ZPA356"]
+    assert checked[4:] in (
+        ["10FAM", "1126", "ZPA356"],
+        ["10FAM", "10FAM", "1126", "ZPA356"],
+    )
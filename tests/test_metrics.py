@@ -0,0 +1,44 @@
+import pytest
+
+from dominos import metrics, networking
+from dominos.fakeserver import FakeServer
+from dominos.networking import Downloader, RetryPolicy, Throttle, get_url
+
+
+@pytest.fixture
+def sink():
+    sink = metrics.MemorySink()
+    metrics.configure(sink)
+    yield sink
+    metrics.configure()
+
+
+def get_histogram(sink, name, **labels):
+    return sink.registry.histograms[(name, tuple(sorted(labels.items())))]
+
+
+def test_throttle_wait(sink):
+    throttle = Throttle(rate=100)
+    for _ in range(3):
+        with throttle.limit("http://localhost/"):
+            pass
+
+    histogram = get_histogram(sink, "dominos_throttle_wait_seconds")
+    assert histogram.count == 3
+    assert histogram.sum == pytest.approx(throttle.stats()["waited"])
+
+
+def test_retry_delay(sink, monkeypatch):
+    monkeypatch.setattr(networking, "_breakers", {})
+    policy = RetryPolicy(backoff_factor=0.001, max_backoff=0.01)
+    downloader = Downloader(retries=3, retry_policy=policy)
+
+    with FakeServer(error_rate=1):
+        response = downloader.get(get_url("promociones"))
+
+    assert response.status_code == 503
+    histogram = get_histogram(
+        sink, "dominos_retry_delay_seconds", endpoint="promociones"
+    )
+    assert histogram.count == 2
+    assert 0 < histogram.sum <= 0.02
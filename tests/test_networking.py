@@ -0,0 +1,154 @@
+import asyncio
+import time
+
+import pytest
+import requests
+
+from dominos import networking
+from dominos.aio import AsyncDownloader
+from dominos.exceptions import CircuitOpenError, DownloaderError
+from dominos.fakeserver import FakeServer
+from dominos.networking import (
+    CircuitBreaker,
+    Downloader,
+    RetryBudget,
+    RetryPolicy,
+    get_retry_policy,
+    get_url,
+)
+
+RECOVERY_TIMEOUT = 0.05
+
+
+class Interrupted(BaseException):
+    pass
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = CircuitBreaker(
+        "promociones", failure_threshold=2, recovery_timeout=RECOVERY_TIMEOUT
+    )
+    monkeypatch.setattr(networking, "_breakers", {"promociones": breaker})
+    return breaker
+
+
+def open_circuit(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_opens_after_consecutive_failures(breaker):
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.before_request() is False
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert 0 < breaker.retry_in() <= RECOVERY_TIMEOUT
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+
+def test_half_open_lets_a_single_probe(breaker):
+    open_circuit(breaker)
+    time.sleep(RECOVERY_TIMEOUT)
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.retry_in() == 0
+    assert breaker.before_request() is True
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+
+def test_probe_success_closes(breaker):
+    open_circuit(breaker)
+    time.sleep(RECOVERY_TIMEOUT)
+    breaker.before_request()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.before_request() is False
+
+
+def test_probe_failure_opens_again(breaker):
+    open_circuit(breaker)
+    time.sleep(RECOVERY_TIMEOUT)
+    breaker.before_request()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+
+def test_aborted_probe_lets_another_one(breaker):
+    open_circuit(breaker)
+    time.sleep(RECOVERY_TIMEOUT)
+    breaker.before_request()
+
+    breaker.abort_probe()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.before_request() is True
+
+
+def test_interrupted_probe_is_aborted(breaker, monkeypatch):
+    def interrupted_request(*args, **kwargs):
+        raise Interrupted()
+
+    open_circuit(breaker)
+    time.sleep(RECOVERY_TIMEOUT)
+    monkeypatch.setattr(requests.Session, "request", interrupted_request)
+
+    with pytest.raises(Interrupted):
+        Downloader().get("http://localhost/promociones")
+    assert breaker.before_request() is True
+
+
+def test_cancelled_async_probe_is_aborted(breaker):
+    async def cancel_probe():
+        async with AsyncDownloader() as downloader:
+            task = asyncio.ensure_future(downloader.get(get_url("promociones")))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    open_circuit(breaker)
+    time.sleep(RECOVERY_TIMEOUT)
+    with FakeServer(latency=1):
+        asyncio.run(cancel_probe())
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.before_request() is True
+
+
+def test_retries_dont_deposit_in_budget(monkeypatch):
+    attempts = []
+
+    def failing_request(*args, **kwargs):
+        attempts.append(args)
+        raise requests.exceptions.ConnectionError()
+
+    monkeypatch.setattr(requests.Session, "request", failing_request)
+    budget = RetryBudget(ratio=1, min_retries=0)
+    policy = RetryPolicy(backoff_factor=0, budget=budget)
+
+    with pytest.raises(DownloaderError):
+        Downloader(retries=5, retry_policy=policy).get("http://localhost/tienda")
+    assert len(attempts) == 2
+    assert policy.stats()["budget_exhausted"] == 1
+
+
+def test_retry_policy_follows_settings(monkeypatch):
+    policy = get_retry_policy()
+    assert get_retry_policy() is policy
+
+    monkeypatch.setattr(networking.settings, "retry_budget_ratio", 0.5)
+    monkeypatch.setattr(networking.settings, "max_backoff", 1)
+    policy = get_retry_policy()
+    assert policy.budget.ratio == 0.5
+    assert policy.max_backoff == 1
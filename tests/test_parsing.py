@@ -0,0 +1,102 @@
+import re
+from pathlib import Path
+
+import pytest
+
+from dominos import parsing
+from dominos.locations import build_shop_from_soup
+from dominos.parsing import parse_elements, parse_promotions, parse_token
+from dominos.schemas import OrderType
+
+FIXTURES_PATH = Path(__file__).parent.parent / "benchmarks" / "fixtures"
+
+
+def read_fixture(name: str) -> str:
+    return (FIXTURES_PATH / name).read_text("utf8")
+
+
+def get_variant(html: str) -> str:
+    """Single-quoted attributes, several classes and nested tags of the same
+    name, which the regex backend must handle like the parsers."""
+
+    html = re.sub(r'="([^"]*)"', r"='\1'", html)
+    html = html.replace("class='promo-content'", "class='promo-content destacada'")
+    html = html.replace("class='listTiendas'", "class='nav listTiendas'")
+    html = html.replace("<h3>", "<div class='promo-title'><div><h3>")
+    html = html.replace("</h3>", "</h3></div></div>")
+    html = html.replace("<p>Horario", "<ul class='horario'><li>L-D</li></ul><p>Horario")
+    return html
+
+
+PAGES = {
+    "fixture": lambda x: x,
+    "variant": get_variant,
+}
+
+
+@pytest.fixture(params=parsing.BACKENDS)
+def backend(request, monkeypatch):
+    monkeypatch.setattr(parsing.settings, "backend", request.param)
+    return request.param
+
+
+def parse_all(html: str, parser):
+    results = {}
+    for backend in parsing.BACKENDS:
+        parsing.settings.backend = backend
+        results[backend] = parser(html)
+    return results
+
+
+def parse_shops(html: str):
+    shops_list = parse_elements(html, "ul", class_="listTiendas")[0]
+    shops = shops_list.find_all("li", attrs={"data-idtienda": True})
+    return [build_shop_from_soup(x) for x in shops]
+
+
+@pytest.mark.parametrize("page", PAGES)
+def test_parse_token(backend, page):
+    html = PAGES[page](read_fixture("promociones.html"))
+    assert parse_token(html) == "MFuYz8n5w2BxKhGO7SFEavdQGD-sclvtX-j5N2Txrvs"
+
+
+@pytest.mark.parametrize("page", PAGES)
+def test_parse_promotions(backend, page):
+    html = PAGES[page](read_fixture("promociones.html"))
+    promotions = parse_promotions(html, OrderType.delivery)
+
+    assert [x.description for x in promotions] == [
+        "Pizza mediana familiar por 10€",
+        "2 pizzas medianas por 11,26€",
+    ]
+    assert all(x.order_type == OrderType.delivery for x in promotions)
+    assert all(str(x.expires) == "2026-11-17" for x in promotions)
+
+
+@pytest.mark.parametrize("page", PAGES)
+def test_parse_shops(backend, page):
+    html = PAGES[page](read_fixture("buscar-tiendas.html"))
+    shops = parse_shops(html)
+
+    assert [x.id for x in shops] == [1500050, 1500051, 1500052]
+    assert shops[0].name_alias == "Arteixo, Calle Real 192"
+    assert [x.coords.lat for x in shops] == [42.637508, 39.814931, 42.703527]
+
+
+@pytest.mark.parametrize("page", PAGES)
+@pytest.mark.parametrize(
+    "fixture, parser",
+    [
+        ("promociones.html", parse_token),
+        ("promociones.html", lambda x: parse_promotions(x, OrderType.pick_up)),
+        ("buscar-tiendas.html", parse_shops),
+    ],
+)
+def test_backends_agree(monkeypatch, page, fixture, parser):
+    monkeypatch.setattr(parsing.settings, "backend", parsing.settings.backend)
+    html = PAGES[page](read_fixture(fixture))
+
+    results = parse_all(html, parser)
+
+    expected = results["html.parser"]
+    assert all(x == expected for x in results.values())